@@ -1,24 +1,49 @@
+from startup import STARTUP
 import streamlit as st
-import requests
-import json
 import os
-import hashlib
+import time
 from datetime import datetime, timedelta
 from collections import defaultdict
+from functools import partial
 import logging
+from synthesis import PANEL_AGENTS, query_panel, tree_synthesize
+from groq_pool import GroqKeyPool
+from tracing import span, setup_logging
+from contextlib import nullcontext
+from history import AnswerHistory
+from escalation import ESCALATION, build_reuse, take
+import consensus
+
+STARTUP.mark("imports")
 
 # ========== LOGGING SETUP ==========
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Log non bloccante tramite coda, ogni riga porta il trace id
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # ========== CONFIGURAZIONE SICURA ==========
 st.set_page_config(page_title="Multi-AI Agent", page_icon="🤖", layout="wide")
 
-# API Key master (DA ENVIRONMENT - invisibile agli utenti)
-MASTER_GROQ_KEY = os.getenv("GROQ_API_KEY", "")
+# API Keys master (DA ENVIRONMENT - invisibili agli utenti)
+# GROQ_API_KEYS (separate da virgola) e/o GROQ_API_KEY
+@st.cache_resource
+def get_groq_pool():
+    """Pool di chiavi condiviso tra sessioni e rerun"""
+    pool = GroqKeyPool.from_env()
+    # Apre subito la connessione a Groq, mentre l'utente fa login
+    pool.prewarm()
+    return pool
+
+GROQ_POOL = get_groq_pool()
+
+# Storico risposte ricercabile (HISTORY_DB)
+@st.cache_resource
+def get_history():
+    """Storico condiviso tra sessioni e rerun"""
+    return AnswerHistory()
+
+HISTORY = get_history()
+STARTUP.mark("groq_pool")
 
 # Email autorizzate (DA ENVIRONMENT - invisibile su GitHub)
 AUTHORIZED_EMAILS_RAW = os.getenv("AUTHORIZED_EMAILS", "")
@@ -35,8 +60,8 @@ MAX_LOGIN_ATTEMPTS = 5
 LOCKOUT_DURATION_MINUTES = 60
 
 # ========== VERIFICA CONFIGURAZIONE ==========
-if not MASTER_GROQ_KEY:
-    st.error("⚠️ GROQ_API_KEY non configurata. Contatta l'amministratore.")
+if not GROQ_POOL:
+    st.error("⚠️ GROQ_API_KEY / GROQ_API_KEYS non configurata. Contatta l'amministratore.")
     st.stop()
 
 if not AUTHORIZED_EMAILS:
@@ -208,15 +233,8 @@ def show_login_page():
         st.caption(f"🛡️ Massimo {MAX_LOGIN_ATTEMPTS} tentativi di login")
 
 # ========== GROQ API ==========
-def query_groq(model, system_msg, user_msg):
-    """Query Groq API usando chiave master"""
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    
-    headers = {
-        "Authorization": f"Bearer {MASTER_GROQ_KEY}",
-        "Content-Type": "application/json"
-    }
-    
+def query_groq(model, system_msg, user_msg, user_email=None):
+    """Query Groq API usando il pool di chiavi master"""
     data = {
         "model": model,
         "messages": [
@@ -228,20 +246,69 @@ def query_groq(model, system_msg, user_msg):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()["choices"][0]["message"]["content"]
+        result = GROQ_POOL.chat(data, timeout=60)["choices"][0]["message"]["content"]
         
         # Log utilizzo
-        logger.info(f"API call: {model} by {st.session_state.user_email}")
+        # user_email esplicita quando chiamata da thread paralleli (no session_state)
+        logger.info(f"API call: {model} by {user_email or st.session_state.user_email}")
         
         return result
     except Exception as e:
         logger.error(f"Groq API error: {e}")
         return f"Errore API: {str(e)}"
 
+def ask_agent(model, role, system_msg, domanda, reuse=None):
+    """Risposta dell'agente, riusata se la modalità precedente ha già interpellato lo stesso modello.
+
+    Ritorna (risposta, riusata).
+    """
+    with span("agent", role=role, model=model) as s:
+        r = take(reuse, model)
+        s.set("reused", r is not None)
+        if r is not None:
+            return r, True
+        return query_groq(model, system_msg, domanda), False
+
+# ========== STORICO ==========
+def save_history(mode, domanda, finale, agents, responses, started):
+    """Salva risposta finale e risposte degli agenti nello storico"""
+    try:
+        HISTORY.add(
+            user=st.session_state.user_email,
+            source="streamlit",
+            mode=mode,
+            question=domanda,
+            answer=finale,
+            agents=[(role, model, resp) for (model, *_), (role, resp) in zip(agents, responses)],
+            duration=time.time() - started
+        )
+    except Exception as e:
+        logger.error(f"History error: {e}")
+
+# ========== ESCALATION ==========
+def request_escalation(next_mode):
+    """Callback del pulsante ⬆️: la modalità viene eseguita al prossimo rerun"""
+    st.session_state.escalate_to = next_mode
+
+def offer_escalation(mode, domanda, agents, responses, carried):
+    """Ricorda le risposte degli agenti e offre il pulsante per la modalità successiva"""
+    st.session_state.last_run = {
+        "mode": mode,
+        "question": domanda,
+        # Anche le risposte riusate ma non usate da questa modalità restano disponibili
+        "agents": [(role, model, resp) for (model, *_), (role, resp) in zip(agents, responses)] + carried,
+    }
+    next_mode = ESCALATION.get(mode)
+    if next_mode:
+        st.button(
+            f"⬆️ Approfondisci con {next_mode.upper()}",
+            on_click=request_escalation, args=(next_mode,),
+            help="Riusa le risposte già calcolate, interpella solo gli agenti mancanti"
+        )
+
 # ========== MAIN APP ==========
 init_session()
+STARTUP.finish("first_run")
 
 # Check autenticazione
 if not is_session_valid():
@@ -282,13 +349,45 @@ with st.sidebar:
     🟢 **QUICK** - 1 modello - 10s  
     🟡 **STANDARD** - 3 modelli - 30s  
     🟠 **DEEP** - 5 modelli - 60s  
-    🔴 **EXPERT** - 6 modelli - 120s
+    🔴 **EXPERT** - 6 modelli - 120s  
+    🟣 **PANEL** - 12 prospettive - 90s
     """)
     
+    st.markdown("---")
+    st.header("📚 Storico")
+    history_query = st.text_input("Cerca nelle risposte passate", placeholder="es. lavoro remoto")
+    if history_query.strip():
+        results = HISTORY.search(history_query, user=st.session_state.user_email, limit=10)
+        if not results:
+            st.caption("📭 Nessuna risposta trovata")
+        for r in results:
+            date = datetime.fromtimestamp(r["created_at"]).strftime("%d/%m/%Y %H:%M")
+            with st.expander(f"{r['mode'].upper()} · {date} · {r['question'][:40]}"):
+                entry = HISTORY.get(r["id"], st.session_state.user_email)
+                st.caption(f"❓ {entry['question']}")
+                st.markdown(entry["answer"])
+                st.caption(f"🤖 {entry['models']}")
+    
     st.markdown("---")
     st.caption("💰 Servizio gratuito")
     st.caption("🔒 Accesso protetto")
     st.caption(f"👥 {len(AUTHORIZED_EMAILS)} utenti autorizzati")
+    
+    with st.expander(f"🔑 Chiavi API ({len(GROQ_POOL)})"):
+        for key in GROQ_POOL.usage():
+            st.caption(
+                f"`{key['key']}` {key['status']} · {key['calls']} chiamate · "
+                f"{key['errors']} errori · {key['tokens_used']} token"
+            )
+            # Limiti Groq per modello: richieste rimaste e modelli in pausa su questa chiave
+            for model, q in key["models"].items():
+                remaining = q["remaining_requests"] if q["remaining_requests"] is not None else "?"
+                st.caption(f"↳ {model}: {q['status']} · richieste rimaste: {remaining}")
+    
+    with st.expander("🤝 Consenso agenti"):
+        st.caption(f"Sintesi saltata quando il consenso supera {consensus.CONSENSUS_THRESHOLD}")
+        for mode, c in consensus.STATS.report().items():
+            st.caption(f"{mode.upper()}: {c['skipped']}/{c['checked']} saltate · consenso medio {c['avg_score']}")
 
 st.markdown("""
 <div class="main-header">
@@ -303,7 +402,7 @@ domanda = st.text_area("", height=120, placeholder="Esempio: Dovrei cambiare lav
 if domanda.strip():
     st.markdown("### ⚙️ Seleziona Modalità")
     
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
         quick = st.button("🟢 QUICK", use_container_width=True)
@@ -313,136 +412,240 @@ if domanda.strip():
         deep = st.button("🟠 DEEP", use_container_width=True)
     with col4:
         expert = st.button("🔴 EXPERT", use_container_width=True)
+    with col5:
+        panel = st.button("🟣 PANEL", use_container_width=True)
     
-    # QUICK
-    if quick:
-        st.success("🟢 Modalità QUICK")
-        with st.spinner("⏳ Elaborazione..."):
-            risposta = query_groq(
-                "llama-3.3-70b-versatile",
-                "Sei un esperto generalista. Fornisci risposta completa.",
-                domanda
-            )
-        st.markdown("### ✅ Risposta")
-        st.markdown(risposta)
-        st.caption("💰 Costo: $0.00 | Modello: Llama 3.3 70B")
+    # Pulsante ⬆️ sotto la risposta precedente: stessa domanda, modalità successiva
+    escalate_to = st.session_state.pop("escalate_to", None)
+    last_run = st.session_state.get("last_run")
+    reuse, carried = {}, []
+    if escalate_to and last_run and last_run["question"] == domanda:
+        reuse, carried = build_reuse(last_run["agents"]), last_run["agents"]
+        standard = standard or escalate_to == "standard"
+        deep = deep or escalate_to == "deep"
+        expert = expert or escalate_to == "expert"
     
-    # STANDARD
-    elif standard:
-        st.success("🟡 Modalità STANDARD: 3 modelli")
+    mode = next((m for m, clicked in [("quick", quick), ("standard", standard), ("deep", deep),
+                                      ("expert", expert), ("panel", panel)] if clicked), None)
+    
+    # Una traccia per richiesta: chiamate agli agenti, sintesi e rendering
+    with span("streamlit.request", mode=mode, user=st.session_state.user_email) if mode else nullcontext():
+        started = time.time()
         
-        agents = [
-            ("llama-3.1-8b-instant", "Analista Tecnico", "Analisi dettagliata"),
-            ("openai/gpt-oss-20b", "Esperto Pratico", "Esempi concreti"),
-            ("qwen/qwen3-32b", "Pensatore Critico", "Analisi critica")
-        ]
+        # QUICK
+        if quick:
+            st.success("🟢 Modalità QUICK")
+            with st.spinner("⏳ Elaborazione..."):
+                risposta, _ = ask_agent(
+                    "llama-3.3-70b-versatile",
+                    "Esperto Generalista",
+                    "Sei un esperto generalista. Fornisci risposta completa.",
+                    domanda
+                )
+            with span("streamlit.render"):
+                st.markdown("### ✅ Risposta")
+                st.markdown(risposta)
+                st.caption("💰 Costo: $0.00 | Modello: Llama 3.3 70B")
+            
+            save_history("quick", domanda, risposta, [("llama-3.3-70b-versatile",)], [("Esperto Generalista", risposta)], started)
+            offer_escalation("quick", domanda, [("llama-3.3-70b-versatile",)], [("Esperto Generalista", risposta)], carried)
         
-        responses = []
+        # STANDARD
+        elif standard:
+            st.success("🟡 Modalità STANDARD: 3 modelli")
+            
+            agents = [
+                ("llama-3.1-8b-instant", "Analista Tecnico", "Analisi dettagliata"),
+                ("openai/gpt-oss-20b", "Esperto Pratico", "Esempi concreti"),
+                ("qwen/qwen3-32b", "Pensatore Critico", "Analisi critica")
+            ]
+            
+            responses = []
+            reused = 0
+            
+            with st.spinner("⏳ 3 agenti..."):
+                for model, role, goal in agents:
+                    r, was_reused = ask_agent(model, role, f"Sei un {role}. {goal}.", domanda, reuse)
+                    reused += was_reused
+                    responses.append((role, r))
+            
+            # Agenti concordi: la sintesi non serve
+            finale, score = consensus.find_consensus("standard", [r for _, r in responses])
+            agreed = finale is not None
+            if not agreed:
+                with st.spinner("🎯 Sintesi..."):
+                    with span("prompt.build", inputs=len(responses)):
+                        synthesis_prompt = f"Sintetizza queste 3 analisi:\n\n"
+                        for role, resp in responses:
+                            synthesis_prompt += f"{role}: {resp}\n\n"
+                    
+                    with span("synthesis", model="llama-3.3-70b-versatile", inputs=len(responses),
+                              prompt_chars=len(synthesis_prompt)):
+                        finale = query_groq(
+                            "llama-3.3-70b-versatile",
+                            "Sintetizza le analisi in una risposta coerente.",
+                            synthesis_prompt
+                        )
+            
+            with span("streamlit.render"):
+                st.markdown("### ✅ Risposta Finale")
+                st.markdown(finale)
+                
+                with st.expander("📖 Risposte individuali"):
+                    for role, resp in responses:
+                        st.markdown(f"**{role}**")
+                        st.info(resp)
+                
+                st.caption(
+                    "💰 Costo: $0.00 | 3 modelli" + (f" | ♻️ {reused} riutilizzate" if reused else "")
+                    + (f" | 🤝 Agenti concordi ({score:.2f}), sintesi saltata" if agreed else "")
+                )
+            
+            save_history("standard", domanda, finale, agents, responses, started)
+            offer_escalation("standard", domanda, agents, responses, carried)
         
-        with st.spinner("⏳ 3 agenti..."):
-            for model, role, goal in agents:
-                r = query_groq(model, f"Sei un {role}. {goal}.", domanda)
+        # DEEP
+        elif deep:
+            st.warning("🟠 Modalità DEEP: 5 modelli")
+            
+            agents = [
+                ("llama-3.1-8b-instant", "Analista"),
+                ("llama-3.3-70b-versatile", "Stratega"),
+                ("openai/gpt-oss-20b", "Pratico"),
+                ("qwen/qwen3-32b", "Alternativo"),
+                ("meta-llama/llama-4-scout-17b-16e-instruct", "Verificatore")
+            ]
+            
+            responses = []
+            reused = 0
+            progress = st.progress(0)
+            
+            for i, (model, role) in enumerate(agents):
+                st.text(f"⏳ {i+1}/5: {role}...")
+                r, was_reused = ask_agent(model, role, f"Sei un {role}.", domanda, reuse)
+                reused += was_reused
                 responses.append((role, r))
-        
-        with st.spinner("🎯 Sintesi..."):
-            synthesis_prompt = f"Sintetizza queste 3 analisi:\n\n"
-            for role, resp in responses:
-                synthesis_prompt += f"{role}: {resp}\n\n"
+                progress.progress((i+1)/6)
             
-            finale = query_groq(
-                "llama-3.3-70b-versatile",
-                "Sintetizza le analisi in una risposta coerente.",
-                synthesis_prompt
-            )
-        
-        st.markdown("### ✅ Risposta Finale")
-        st.markdown(finale)
-        
-        with st.expander("📖 Risposte individuali"):
-            for role, resp in responses:
-                st.markdown(f"**{role}**")
-                st.info(resp)
-        
-        st.caption("💰 Costo: $0.00 | 3 modelli")
-    
-    # DEEP
-    elif deep:
-        st.warning("🟠 Modalità DEEP: 5 modelli")
-        
-        agents = [
-            ("llama-3.1-8b-instant", "Analista"),
-            ("llama-3.3-70b-versatile", "Stratega"),
-            ("openai/gpt-oss-20b", "Pratico"),
-            ("qwen/qwen3-32b", "Alternativo"),
-            ("meta-llama/llama-4-scout-17b-16e-instruct", "Verificatore")
-        ]
-        
-        responses = []
-        progress = st.progress(0)
-        
-        for i, (model, role) in enumerate(agents):
-            st.text(f"⏳ {i+1}/5: {role}...")
-            r = query_groq(model, f"Sei un {role}.", domanda)
-            responses.append((role, r))
-            progress.progress((i+1)/6)
-        
-        st.text("🎯 Sintesi...")
-        synthesis = "Sintetizza:\n\n"
-        for role, resp in responses:
-            synthesis += f"{role}: {resp}\n\n"
-        
-        finale = query_groq("llama-3.3-70b-versatile", "Sintesi.", synthesis)
-        progress.progress(1.0)
-        
-        st.markdown("### ✅ Risposta DEEP")
-        st.markdown(finale)
-        
-        with st.expander("📊 5 Prospettive"):
-            for role, resp in responses:
-                st.markdown(f"**{role}**")
-                st.info(resp)
-        
-        st.caption("💰 Costo: $0.00 | 5 modelli")
-    
-    # EXPERT
-    elif expert:
-        st.error("🔴 Modalità EXPERT: 6 modelli")
-        
-        agents = [
-            ("llama-3.1-8b-instant", "Analista"),
-            ("llama-3.3-70b-versatile", "Stratega"),
-            ("openai/gpt-oss-120b", "Profondo"),
-            ("openai/gpt-oss-20b", "Pratico"),
-            ("qwen/qwen3-32b", "Critico"),
-            ("meta-llama/llama-4-scout-17b-16e-instruct", "Verificatore")
-        ]
-        
-        responses = []
-        progress = st.progress(0)
-        
-        for i, (model, role) in enumerate(agents):
-            st.text(f"⏳ {i+1}/6: {role}...")
-            r = query_groq(model, f"Sei un {role}.", domanda)
-            responses.append((role, r))
-            progress.progress((i+1)/7)
-        
-        st.text("🎯 Super-sintesi...")
-        synthesis = "Sintesi da 6 AI:\n\n"
-        for role, resp in responses:
-            synthesis += f"{role}: {resp}\n\n"
-        
-        finale = query_groq("llama-3.3-70b-versatile", "Sintesi master.", synthesis)
-        progress.progress(1.0)
-        
-        st.markdown("### 🏆 Risposta EXPERT")
-        st.markdown(finale)
+            finale, score = consensus.find_consensus("deep", [r for _, r in responses])
+            agreed = finale is not None
+            if not agreed:
+                st.text("🎯 Sintesi...")
+                with span("prompt.build", inputs=len(responses)):
+                    synthesis = "Sintetizza:\n\n"
+                    for role, resp in responses:
+                        synthesis += f"{role}: {resp}\n\n"
+                
+                with span("synthesis", model="llama-3.3-70b-versatile", inputs=len(responses),
+                          prompt_chars=len(synthesis)):
+                    finale = query_groq("llama-3.3-70b-versatile", "Sintesi.", synthesis)
+            progress.progress(1.0)
+            
+            with span("streamlit.render"):
+                st.markdown("### ✅ Risposta DEEP")
+                st.markdown(finale)
+                
+                with st.expander("📊 5 Prospettive"):
+                    for role, resp in responses:
+                        st.markdown(f"**{role}**")
+                        st.info(resp)
+                
+                st.caption(
+                    "💰 Costo: $0.00 | 5 modelli" + (f" | ♻️ {reused} riutilizzate" if reused else "")
+                    + (f" | 🤝 Agenti concordi ({score:.2f}), sintesi saltata" if agreed else "")
+                )
+            
+            save_history("deep", domanda, finale, agents, responses, started)
+            offer_escalation("deep", domanda, agents, responses, carried)
         
-        with st.expander("📊 6 Prospettive"):
-            for role, resp in responses:
-                st.markdown(f"**{role}**")
-                st.info(resp)
+        # EXPERT
+        elif expert:
+            st.error("🔴 Modalità EXPERT: 6 modelli")
+            
+            agents = [
+                ("llama-3.1-8b-instant", "Analista"),
+                ("llama-3.3-70b-versatile", "Stratega"),
+                ("openai/gpt-oss-120b", "Profondo"),
+                ("openai/gpt-oss-20b", "Pratico"),
+                ("qwen/qwen3-32b", "Critico"),
+                ("meta-llama/llama-4-scout-17b-16e-instruct", "Verificatore")
+            ]
+            
+            responses = []
+            reused = 0
+            progress = st.progress(0)
+            
+            for i, (model, role) in enumerate(agents):
+                st.text(f"⏳ {i+1}/6: {role}...")
+                r, was_reused = ask_agent(model, role, f"Sei un {role}.", domanda, reuse)
+                reused += was_reused
+                responses.append((role, r))
+                progress.progress((i+1)/7)
+            
+            finale, score = consensus.find_consensus("expert", [r for _, r in responses])
+            agreed = finale is not None
+            if not agreed:
+                st.text("🎯 Super-sintesi...")
+                with span("prompt.build", inputs=len(responses)):
+                    synthesis = "Sintesi da 6 AI:\n\n"
+                    for role, resp in responses:
+                        synthesis += f"{role}: {resp}\n\n"
+                
+                with span("synthesis", model="llama-3.3-70b-versatile", inputs=len(responses),
+                          prompt_chars=len(synthesis)):
+                    finale = query_groq("llama-3.3-70b-versatile", "Sintesi master.", synthesis)
+            progress.progress(1.0)
+            
+            with span("streamlit.render"):
+                st.markdown("### 🏆 Risposta EXPERT")
+                st.markdown(finale)
+                
+                with st.expander("📊 6 Prospettive"):
+                    for role, resp in responses:
+                        st.markdown(f"**{role}**")
+                        st.info(resp)
+                
+                st.caption(
+                    "💰 Costo: $0.00 | 6 modelli" + (f" | ♻️ {reused} riutilizzate" if reused else "")
+                    + (f" | 🤝 Agenti concordi ({score:.2f}), sintesi saltata" if agreed else "")
+                )
+            
+            save_history("expert", domanda, finale, agents, responses, started)
         
-        st.caption("💰 Costo: $0.00 | 6 modelli")
+        # PANEL
+        elif panel:
+            st.info("🟣 Modalità PANEL: 12 prospettive + sintesi gerarchica")
+            
+            agents = PANEL_AGENTS
+            
+            # Chiamate in thread paralleli: email passata esplicitamente
+            query_fn = partial(query_groq, user_email=st.session_state.user_email)
+            
+            with st.spinner(f"⏳ {len(agents)} prospettive in parallelo..."):
+                responses = query_panel(query_fn, agents, domanda)
+            
+            with st.spinner("🎯 Sintesi gerarchica..."):
+                finale = tree_synthesize(
+                    query_fn,
+                    domanda,
+                    responses,
+                    "openai/gpt-oss-120b",
+                    "Crea sintesi definitiva integrando tutte le prospettive del panel.",
+                    f"Crea sintesi definitiva da queste analisi di un panel di {len(agents)} esperti:"
+                )
+            
+            with span("streamlit.render"):
+                st.markdown("### 🟣 Risposta PANEL")
+                st.markdown(finale)
+                
+                with st.expander(f"📊 {len(agents)} Prospettive"):
+                    for role, resp in responses:
+                        st.markdown(f"**{role}**")
+                        st.info(resp)
+                
+                st.caption(f"💰 Costo: $0.00 | {len(agents)} prospettive")
+            
+            save_history("panel", domanda, finale, agents, responses, started)
 
 st.markdown("---")
 st.markdown(f"**Multi-AI System** | Utente: {st.session_state.user_name} | Sicuro e Privato")
@@ -0,0 +1,233 @@
+import os
+import re
+import math
+import logging
+import threading
+from collections import Counter
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# ========== CONFIGURATION ==========
+# Skip the synthesis call when every agent agrees at least this much (0-1, above 1 = never skip)
+CONSENSUS_THRESHOLD = float(os.getenv('CONSENSUS_THRESHOLD', 0.6))
+# "best": return the most representative answer; "merge": also append what the others add
+CONSENSUS_STRATEGY = os.getenv('CONSENSUS_STRATEGY', "best")
+MERGE_MAX_SENTENCES = 3
+
+# Per pair of answers: lexical similarity and key-claim overlap weigh the same
+LEXICAL_WEIGHT = 0.5
+KEY_TERMS = 12
+# Answers quoting different figures for the same question do not agree
+NUMBER_CONFLICT_PENALTY = 0.5
+# Nor do answers naming different things ("impara Rust" against "impara Go")
+NAME_CONFLICT_PENALTY = 0.5
+# Nor do answers where one negates a statement the other makes
+POLARITY_CONFLICT_PENALTY = 0.25
+# Two clauses make the same statement when they share this much of their terms
+SAME_STATEMENT_OVERLAP = 0.6
+
+NEGATIONS = set("""
+non no né mai nessun nessuno nessuna niente nulla senza
+not no nor never none nothing neither without cannot
+""".split())
+
+STOPWORDS = set("""
+il lo la i gli le un uno una di a da in con su per tra fra e ed o od ma se che chi cui più
+del dello della dei degli delle al allo alla ai agli alle dal dallo dalla dai dagli dalle nel
+nello nella nei negli nelle sul sullo sulla sui sugli sulle è sono essere ha hanno avere come
+anche questo questa questi queste quello quella quelli quelle ci si ne mi ti vi lo può possono
+molto molti molte poi già ancora sempre quando dove perché quindi però invece così tutto tutti
+the a an of to in on for with and or but if that this these those is are be been being was were
+it its as at by from can could should would will may might do does did has have had
+more most very also so than then there their they you your we our i he she his her which what
+""".split())
+
+
+def tokens(text):
+    """Content words, lowercased and cut to a 6 letter stem (cheap, good enough for IT and EN).
+    Negations are kept: they flip what a sentence says"""
+    return [
+        w[:6] for w in re.findall(r"[^\W\d_]+", text.lower())
+        if w in NEGATIONS or (w not in STOPWORDS and len(w) > 2)
+    ]
+
+
+def numbers(text):
+    return set(n.replace(",", ".") for n in re.findall(r"\d+(?:[.,]\d+)?", text))
+
+
+def names(text):
+    """Proper nouns and acronyms, lowercased: capitalized words not opening a sentence.
+    Short ones count too ("Go", "C"), the subject of an answer is often one"""
+    found = set()
+    for s in sentences(text):
+        for w in re.findall(r"[^\W\d_][\w+#]*", s)[1:]:
+            if w[0].isupper() and w.lower() not in STOPWORDS and w.lower() not in NEGATIONS:
+                found.add(w.lower())
+    return found
+
+
+def sentences(text):
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+
+
+def clauses(text):
+    """Sentences cut at commas and semicolons, so each part negates at most one thing"""
+    return [c.strip() for s in sentences(text) for c in re.split(r"[,;:]", s) if c.strip()]
+
+
+def statement(clause):
+    """(terms, negated) of a clause: what it talks about and whether it denies it"""
+    words = re.findall(r"[^\W\d_]+", clause.lower())
+    negations = sum(w in NEGATIONS for w in words)
+    terms = {w[:6] for w in words if w not in NEGATIONS and w not in STOPWORDS and len(w) > 2}
+    return terms, negations % 2 == 1
+
+
+class Profile:
+    """What one answer says: term frequencies, key terms, quoted figures, names and statements"""
+
+    def __init__(self, text):
+        self.text = text
+        self.words = set(re.findall(r"[^\W\d_][\w+#]*", text.lower()))
+        self.names = names(text)
+        self.tf = Counter(tokens(text))
+        self.norm = math.sqrt(sum(c * c for c in self.tf.values()))
+        self.numbers = numbers(text)
+        self.claims = {t for t, _ in self.tf.most_common(KEY_TERMS) if t not in NEGATIONS} | self.numbers
+        self.statements = [st for st in map(statement, clauses(text)) if len(st[0]) >= 2]
+
+
+def cosine(a, b):
+    if not a.norm or not b.norm:
+        return 0.0
+    return sum(c * b.tf[t] for t, c in a.tf.items()) / (a.norm * b.norm)
+
+
+def claim_overlap(a, b):
+    if not a.claims or not b.claims:
+        return 0.0
+    return len(a.claims & b.claims) / len(a.claims | b.claims)
+
+
+def contradicts(a, b):
+    """True when a clause of one answer denies what a clause of the other states"""
+    for terms_a, negated_a in a.statements:
+        for terms_b, negated_b in b.statements:
+            if negated_a != negated_b and len(terms_a & terms_b) / len(terms_a | terms_b) >= SAME_STATEMENT_OVERLAP:
+                return True
+    return False
+
+
+def names_conflict(a, b):
+    """True when each answer names something the other never mentions"""
+    return bool(a.names - b.words) and bool(b.names - a.words)
+
+
+def similarity(a, b):
+    score = LEXICAL_WEIGHT * cosine(a, b) + (1 - LEXICAL_WEIGHT) * claim_overlap(a, b)
+    if a.numbers and b.numbers and not a.numbers & b.numbers:
+        score *= NUMBER_CONFLICT_PENALTY
+    if names_conflict(a, b):
+        score *= NAME_CONFLICT_PENALTY
+    if contradicts(a, b):
+        score *= POLARITY_CONFLICT_PENALTY
+    return score
+
+
+def agreement(answers):
+    """Score how much the answers agree.
+
+    Each answer gets its mean similarity to the others; the consensus is
+    only as strong as the answer that agrees least. Returns
+    (score, index of the most representative answer).
+    """
+    profiles = [Profile(a) for a in answers]
+    n = len(profiles)
+    support = []
+    for i in range(n):
+        others = [similarity(profiles[i], profiles[j]) for j in range(n) if j != i]
+        support.append(sum(others) / len(others))
+    best = max(range(n), key=lambda i: (support[i], len(answers[i])))
+    return min(support), best
+
+
+def merge(best, others, max_sentences=MERGE_MAX_SENTENCES):
+    """Best answer plus the few sentences of the others it does not already cover"""
+    covered = set(tokens(best))
+    extra = []
+    for answer in others:
+        for sentence in sentences(answer):
+            terms = set(tokens(sentence))
+            if len(terms) >= 5 and len(terms - covered) / len(terms) > 0.6:
+                extra.append(sentence)
+                covered |= terms
+            if len(extra) >= max_sentences:
+                break
+        if len(extra) >= max_sentences:
+            break
+    if not extra:
+        return best
+    return best + "\n\n*Inoltre:*\n" + "\n".join(f"- {s}" for s in extra)
+
+
+class ConsensusStats:
+    """Per-mode counts of consensus checks and skipped syntheses in this process.
+
+    The bot's /metrics reads them from the job queue instead, so external
+    workers are counted too.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.modes = {}
+
+    def record(self, mode, score, hit):
+        with self.lock:
+            m = self.modes.setdefault(mode, {"checked": 0, "skipped": 0, "score_sum": 0.0})
+            m["checked"] += 1
+            m["skipped"] += hit
+            m["score_sum"] += score
+
+    def report(self):
+        with self.lock:
+            return {
+                mode: {
+                    "checked": m["checked"],
+                    "skipped": m["skipped"],
+                    "hit_rate": round(m["skipped"] / m["checked"], 3),
+                    "avg_score": round(m["score_sum"] / m["checked"], 3),
+                }
+                for mode, m in self.modes.items()
+            }
+
+
+STATS = ConsensusStats()
+
+
+def find_consensus(mode, answers, threshold=None, strategy=None):
+    """Final answer when the agents already agree, else None (synthesize as usual).
+
+    Failed answers are ignored; at least two good ones are needed.
+    Returns (answer or None, score), score None when there was nothing to compare.
+    """
+    threshold = CONSENSUS_THRESHOLD if threshold is None else threshold
+    strategy = strategy or CONSENSUS_STRATEGY
+    good = [a for a in answers if a and not a.startswith("Errore API")]
+    if len(good) < 2:
+        return None, None
+
+    with span("consensus", mode=mode, answers=len(good), threshold=threshold) as s:
+        score, best = agreement(good)
+        hit = score >= threshold
+        s.set("score", round(score, 3))
+        s.set("hit", hit)
+    STATS.record(mode, score, hit)
+    if not hit:
+        return None, score
+
+    logger.info(f"Consensus {score:.2f} in {mode}: synthesis skipped")
+    if strategy == "merge":
+        return merge(good[best], good[:best] + good[best + 1:]), score
+    return good[best], score
@@ -0,0 +1,29 @@
+# Modes share models (llama-3.1-8b-instant, gpt-oss-20b and qwen3-32b are in
+# STANDARD, DEEP and EXPERT), so escalating a question only runs the agents
+# the deeper mode adds and reuses the rest.
+
+# Next depth for each mode
+ESCALATION = {
+    "quick": "standard",
+    "standard": "deep",
+    "deep": "expert",
+}
+
+
+def build_reuse(agents):
+    """Index already computed (role, model, answer) triples by model.
+
+    Failed answers are left out so they get a fresh try.
+    """
+    reuse = {}
+    for role, model, answer in agents:
+        if answer.startswith("Errore API"):
+            continue
+        reuse.setdefault(model, []).append(answer)
+    return reuse
+
+
+def take(reuse, model):
+    """Pop a reusable answer for model, or None"""
+    answers = reuse.get(model) if reuse else None
+    return answers.pop(0) if answers else None
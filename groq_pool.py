@@ -0,0 +1,323 @@
+import os
+import re
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# ========== CONFIGURATION ==========
+GROQ_API_URL = os.getenv('GROQ_API_URL', "https://api.groq.com/openai/v1/chat/completions")
+
+# Consecutive failures (network / 5xx) before a key is benched
+MAX_FAILURES = 3
+FAILURE_COOLDOWN_SECONDS = 30
+# Cooldown on 429 when Groq sends no retry-after / reset header
+RATE_LIMIT_COOLDOWN_SECONDS = 60
+# How long a call waits for a benched key before giving up
+MAX_WAIT_SECONDS = float(os.getenv('GROQ_POOL_MAX_WAIT', 10))
+
+# Status codes that say "this key, not this request, is the problem": try another key
+AUTH_ERRORS = (401, 403)
+KEY_ERRORS = AUTH_ERRORS + (429,)
+# Timeouts, connection errors and 5xx are not the key's fault: retried at most this often
+MAX_TRANSIENT_RETRIES = 1
+
+
+class NoKeyAvailable(Exception):
+    """All keys are exhausted, failing or disabled"""
+
+
+def parse_reset(value):
+    """Parse Groq reset durations like '2m59.56s', '7.66s' or '120ms' into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class ModelQuota:
+    """Rate limit window of one key for one model.
+
+    Groq limits every model separately and its x-ratelimit-* headers
+    describe the model that was just called.
+    """
+
+    def __init__(self):
+        # From x-ratelimit-* headers (None until the first response)
+        self.limit_requests = None
+        self.remaining_requests = None
+        self.reset_requests_at = 0.0
+        self.limit_tokens = None
+        self.remaining_tokens = None
+        self.reset_tokens_at = 0.0
+        self.inflight = 0
+        self.cooldown_until = 0.0
+
+    def headroom(self, now):
+        """Fraction of quota left (0-1), in-flight calls counted as spent"""
+        fractions = []
+        if self.limit_requests and now < self.reset_requests_at:
+            fractions.append((self.remaining_requests - self.inflight) / self.limit_requests)
+        if self.limit_tokens and now < self.reset_tokens_at:
+            fractions.append(self.remaining_tokens / self.limit_tokens)
+        if not fractions:
+            # Unknown or already reset: assume a full window
+            fractions.append(1.0 - self.inflight * 0.01)
+        return min(fractions)
+
+    def update_from_headers(self, headers, now):
+        limit = _int_header(headers, "x-ratelimit-limit-requests")
+        remaining = _int_header(headers, "x-ratelimit-remaining-requests")
+        reset = parse_reset(headers.get("x-ratelimit-reset-requests"))
+        if limit is not None and remaining is not None:
+            self.limit_requests, self.remaining_requests = limit, remaining
+            self.reset_requests_at = now + (reset or 0)
+
+        limit = _int_header(headers, "x-ratelimit-limit-tokens")
+        remaining = _int_header(headers, "x-ratelimit-remaining-tokens")
+        reset = parse_reset(headers.get("x-ratelimit-reset-tokens"))
+        if limit is not None and remaining is not None:
+            self.limit_tokens, self.remaining_tokens = limit, remaining
+            self.reset_tokens_at = now + (reset or 0)
+
+        # Bench the model on this key until its window resets once a quota hits zero
+        if self.remaining_requests == 0 and self.reset_requests_at > now:
+            self.cooldown_until = max(self.cooldown_until, self.reset_requests_at)
+        if self.remaining_tokens == 0 and self.reset_tokens_at > now:
+            self.cooldown_until = max(self.cooldown_until, self.reset_tokens_at)
+
+    def usage(self, now):
+        return {
+            "status": f"cooldown {self.cooldown_until - now:.0f}s" if now < self.cooldown_until else "active",
+            "inflight": self.inflight,
+            "remaining_requests": self.remaining_requests,
+            "remaining_tokens": self.remaining_tokens,
+        }
+
+
+class KeyState:
+    """Health of a single API key, with one quota window per model"""
+
+    def __init__(self, key):
+        self.key = key
+        self.name = f"{key[:4]}…{key[-4:]}" if len(key) > 8 else "…"
+        self.models = {}
+        # Health
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+        # Usage, all models together
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.tokens_used = 0
+
+    def quota(self, model):
+        if model not in self.models:
+            self.models[model] = ModelQuota()
+        return self.models[model]
+
+    def free_at(self, model):
+        """When the key can take a call for model again"""
+        return max(self.cooldown_until, self.quota(model).cooldown_until)
+
+    def available(self, model, now):
+        return not self.disabled and now >= self.free_at(model)
+
+    def usage(self, now):
+        if self.disabled:
+            status = "disabled"
+        elif now < self.cooldown_until:
+            status = f"cooldown {self.cooldown_until - now:.0f}s"
+        else:
+            status = "active"
+        return {
+            "key": self.name,
+            "status": status,
+            "calls": self.calls,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "tokens_used": self.tokens_used,
+            "inflight": sum(q.inflight for q in self.models.values()),
+            "models": {model: q.usage(now) for model, q in self.models.items()},
+        }
+
+
+class GroqKeyPool:
+    """Load-balanced pool of Groq API keys.
+
+    Every call goes to the key with the most quota headroom for the model
+    being called, as reported by Groq's x-ratelimit-* response headers.
+    A key that hits a model's limit is benched for that model only; keys
+    that keep failing are benched until they recover; invalid keys are
+    disabled.
+    """
+
+    def __init__(self, keys, url=GROQ_API_URL, max_wait=MAX_WAIT_SECONDS):
+        self.keys = [KeyState(k) for k in dict.fromkeys(keys)]
+        self.url = url
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def from_env(cls):
+        """Keys from GROQ_API_KEYS (comma separated) plus GROQ_API_KEY"""
+        raw = os.getenv('GROQ_API_KEYS', "").split(",") + [os.getenv('GROQ_API_KEY', "")]
+        return cls([k.strip() for k in raw if k.strip()])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def prewarm(self):
+        """Open the TLS connection to Groq in the background, so the first
+        real call skips DNS + handshake. Uses no quota."""
+        def warm():
+            start = time.perf_counter()
+            try:
+                self.session.head(self.url, timeout=10)
+                logger.info(f"Groq connection warmed in {time.perf_counter() - start:.2f}s")
+            except requests.RequestException as e:
+                logger.warning(f"Groq prewarm failed: {e}")
+
+        threading.Thread(target=warm, name="groq-prewarm", daemon=True).start()
+
+    # ----- key selection -----
+    def acquire(self, model):
+        """Reserve the key with the most headroom for model, waiting briefly if all are benched"""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                candidates = [k for k in self.keys if k.available(model, now)]
+                if candidates:
+                    best = max(candidates, key=lambda k: (k.quota(model).headroom(now), -k.quota(model).inflight))
+                    best.quota(model).inflight += 1
+                    return best
+                pending = [k.free_at(model) for k in self.keys if not k.disabled]
+
+            if not pending:
+                raise NoKeyAvailable("All Groq API keys are disabled")
+            wait = min(pending) - time.monotonic()
+            if time.monotonic() + wait > deadline:
+                raise NoKeyAvailable(f"All Groq API keys are rate limited for {model} (next free in {wait:.0f}s)")
+            time.sleep(max(wait, 0.05))
+
+    def release(self, state, model, response=None, error=None):
+        """Update key and model quota state from the outcome of a call"""
+        with self.lock:
+            now = time.monotonic()
+            quota = state.quota(model)
+            quota.inflight -= 1
+            state.calls += 1
+
+            if response is not None:
+                quota.update_from_headers(response.headers, now)
+
+            status = response.status_code if response is not None else None
+            if status is not None and status < 400:
+                state.failures = 0
+                return
+
+            state.errors += 1
+            if status in AUTH_ERRORS:
+                state.disabled = True
+                logger.error(f"Groq key {state.name} rejected ({status}), removed from rotation")
+            elif status == 429:
+                state.rate_limited += 1
+                retry_after = parse_reset(response.headers.get("retry-after"))
+                quota.cooldown_until = max(quota.cooldown_until, now + (retry_after or RATE_LIMIT_COOLDOWN_SECONDS))
+                logger.warning(f"Groq key {state.name} rate limited on {model} for {quota.cooldown_until - now:.0f}s")
+            elif status is None or status >= 500:
+                state.failures += 1
+                if state.failures >= MAX_FAILURES:
+                    state.cooldown_until = now + FAILURE_COOLDOWN_SECONDS
+                    logger.warning(f"Groq key {state.name} failing ({error or status}), benched for {FAILURE_COOLDOWN_SECONDS}s")
+
+    # ----- API -----
+    def chat(self, data, timeout=60):
+        """POST a chat completion.
+
+        Auth errors and 429 are the key's fault: the call moves to another
+        key. Timeouts, connection errors and 5xx are retried at most
+        MAX_TRANSIENT_RETRIES times, so a slow Groq costs at most
+        (1 + MAX_TRANSIENT_RETRIES) * timeout.
+        """
+        model = data.get("model")
+        key_failovers = 0
+        transient_retries = 0
+        attempt = 0
+
+        with span("groq.chat", model=model) as chat_span:
+            while True:
+                attempt += 1
+                with span("groq.attempt", attempt=attempt) as attempt_span:
+                    state = self.acquire(model)
+                    attempt_span.set("groq.key", state.name)
+                    try:
+                        response = self.session.post(
+                            self.url,
+                            headers={
+                                "Authorization": f"Bearer {state.key}",
+                                "Content-Type": "application/json"
+                            },
+                            json=data,
+                            timeout=timeout
+                        )
+                    except requests.RequestException as e:
+                        self.release(state, model, error=e)
+                        attempt_span.error(e)
+                        if transient_retries >= MAX_TRANSIENT_RETRIES:
+                            raise
+                        transient_retries += 1
+                        continue
+
+                    self.release(state, model, response=response)
+                    status = response.status_code
+                    attempt_span.set("http.status_code", status)
+                    if status in KEY_ERRORS or status >= 500:
+                        error = requests.HTTPError(f"{status} from Groq (key {state.name})", response=response)
+                        attempt_span.error(error)
+                        if status in KEY_ERRORS and key_failovers < len(self.keys):
+                            key_failovers += 1
+                            continue
+                        if status >= 500 and transient_retries < MAX_TRANSIENT_RETRIES:
+                            transient_retries += 1
+                            continue
+                        raise error
+
+                    response.raise_for_status()
+                    result = response.json()
+                    tokens = result.get("usage", {}).get("total_tokens", 0)
+                    with self.lock:
+                        state.tokens_used += tokens
+                    chat_span.set("groq.attempts", attempt)
+                    chat_span.set("groq.tokens", tokens)
+                    return result
+
+    def usage(self):
+        """Per-key usage report"""
+        with self.lock:
+            now = time.monotonic()
+            return [k.usage(now) for k in self.keys]
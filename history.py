@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import hashlib
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ========== CONFIGURATION ==========
+HISTORY_DB = os.getenv('HISTORY_DB', "history.db")
+
+# bm25 column weights: question, answer, agent answers, owner
+RANK_WEIGHTS = (5.0, 2.0, 1.0, 0.0)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    user TEXT NOT NULL,
+    source TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    agents TEXT NOT NULL,
+    models TEXT NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS answers_user ON answers (user, id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS answers_fts USING fts5(
+    question, answer, agents, owner,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS answers_no_update BEFORE UPDATE ON answers
+BEGIN SELECT RAISE(ABORT, 'answer history is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS answers_no_delete BEFORE DELETE ON answers
+BEGIN SELECT RAISE(ABORT, 'answer history is append-only'); END;
+"""
+
+
+def owner_token(user):
+    """Single FTS token for a user, so per-user searches are narrowed by the index"""
+    return "u" + hashlib.sha1(user.encode()).hexdigest()[:16]
+
+
+def to_fts_query(text):
+    """Turn free text into a safe FTS5 query: every word must match, as a prefix"""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{w}"*' if len(w) >= 3 else f'"{w}"' for w in words)
+
+
+class AnswerHistory:
+    """Append-only store of final answers with a full-text index.
+
+    Each entry keeps who asked, the mode, the question, the final answer,
+    every agent answer with its model, and how long it took. The index
+    covers question, answer and agent answers.
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        """One connection per thread, WAL so searches never wait for inserts"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    # ----- write -----
+    def add(self, user, source, mode, question, answer, agents, duration=None, created_at=None):
+        """Store one answer. agents: [(role, model, answer), ...]. Returns its id"""
+        return self.add_many([{
+            "user": user, "source": source, "mode": mode, "question": question,
+            "answer": answer, "agents": agents, "duration": duration, "created_at": created_at
+        }])[0]
+
+    def add_many(self, entries):
+        """Bulk insert in one transaction. Returns the new ids"""
+        if not entries:
+            return []
+        conn = self._conn()
+        with self.write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM answers").fetchone()[0]
+                ids = list(range(first, first + len(entries)))
+                rows, fts_rows = [], []
+                for id_, e in zip(ids, entries):
+                    agents = [list(a) for a in e["agents"]]
+                    models = sorted({model for _, model, _ in agents})
+                    rows.append((
+                        id_, e.get("created_at") or time.time(), e["user"], e["source"], e["mode"],
+                        e["question"], e["answer"], json.dumps(agents, ensure_ascii=False),
+                        " ".join(models), e.get("duration")
+                    ))
+                    fts_rows.append((
+                        id_, e["question"], e["answer"],
+                        "\n\n".join(f"{role} ({model}): {text}" for role, model, text in agents),
+                        owner_token(e["user"])
+                    ))
+                conn.executemany(
+                    "INSERT INTO answers (id, created_at, user, source, mode, question, answer, agents, models, duration) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.executemany(
+                    "INSERT INTO answers_fts (rowid, question, answer, agents, owner) VALUES (?, ?, ?, ?, ?)",
+                    fts_rows
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    # ----- read -----
+    def search(self, query, user=None, limit=10):
+        """Best matches first, with a snippet of the answer"""
+        fts_query = to_fts_query(query)
+        if not fts_query:
+            return []
+        sql = (
+            "SELECT a.id, a.created_at, a.user, a.source, a.mode, a.question, a.models, a.duration, "
+            "snippet(answers_fts, 1, '', '', '…', 24) AS snippet "
+            "FROM answers_fts JOIN answers a ON a.id = answers_fts.rowid "
+            "WHERE answers_fts MATCH ?"
+        )
+        if user is not None:
+            fts_query = f'owner : "{owner_token(user)}" AND ({fts_query})'
+        params = [fts_query]
+        sql += f" ORDER BY bm25(answers_fts, {', '.join(map(str, RANK_WEIGHTS))}) LIMIT ?"
+        params.append(limit)
+        return [dict(r) for r in self._conn().execute(sql, params)]
+
+    def get(self, entry_id, user=None):
+        """Full entry, agent answers included, or None"""
+        sql = "SELECT * FROM answers WHERE id = ?"
+        params = [entry_id]
+        if user is not None:
+            sql += " AND user = ?"
+            params.append(user)
+        row = self._conn().execute(sql, params).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["agents"] = json.loads(entry["agents"])
+        return entry
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
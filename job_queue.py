@@ -0,0 +1,347 @@
+import abc
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ========== CONFIGURATION ==========
+JOB_QUEUE_URL = os.getenv('JOB_QUEUE_URL', "sqlite:///jobs.db")
+
+# A running job whose worker has not sent a heartbeat for this long is requeued
+LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 300))
+MAX_ATTEMPTS = 3
+MAX_DELIVERY_ATTEMPTS = 5
+# Window for per-worker throughput
+THROUGHPUT_WINDOW_SECONDS = 3600
+
+
+class JobQueue(abc.ABC):
+    """Durable job queue between the bot front end and pipeline workers.
+
+    Jobs go queued -> running -> done | failed, and are then delivered
+    back to their chat by the front end. Backends implement every method
+    below; see SQLiteJobQueue.
+    """
+
+    @classmethod
+    @abc.abstractmethod
+    def from_url(cls, url):
+        """Build the queue from a JOB_QUEUE_URL (see open_queue)"""
+
+    @abc.abstractmethod
+    def enqueue(self, mode, question, chat_id, status_message_id=None, trace_id=None, parent_span_id=None,
+                escalated_from=None):
+        """Add a job, return its id. trace_id/parent_span_id continue the caller's trace,
+        escalated_from is the job whose agent answers this one reuses"""
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        """One job by id, or None"""
+
+    @abc.abstractmethod
+    def claim(self, worker_id):
+        """Atomically take the oldest queued job, or None"""
+
+    @abc.abstractmethod
+    def heartbeat(self, job_id):
+        """The worker is still on job_id"""
+
+    @abc.abstractmethod
+    def set_progress(self, job_id, text):
+        """Progress message for the user, also a heartbeat"""
+
+    @abc.abstractmethod
+    def complete(self, job_id, result):
+        """Store the pipeline result, the job is done"""
+
+    @abc.abstractmethod
+    def fail(self, job_id, error):
+        """The job failed with error"""
+
+    @abc.abstractmethod
+    def requeue_stale(self, lease_seconds=LEASE_SECONDS):
+        """Requeue running jobs whose worker died, return how many"""
+
+    @abc.abstractmethod
+    def progress_updates(self):
+        """Running jobs whose progress has not been shown to the user yet"""
+
+    @abc.abstractmethod
+    def mark_progress_delivered(self, job_id, text):
+        """text is now shown in the status message"""
+
+    @abc.abstractmethod
+    def finished(self, limit=20):
+        """Done or failed jobs not delivered yet"""
+
+    @abc.abstractmethod
+    def mark_part_delivered(self, job_id, part):
+        """Parts 1..part of the answer reached the chat: a retried delivery resumes after them"""
+
+    @abc.abstractmethod
+    def mark_delivered(self, job_id):
+        """The answer reached the chat"""
+
+    @abc.abstractmethod
+    def delivery_failed(self, job_id):
+        """Count a failed delivery, give up after MAX_DELIVERY_ATTEMPTS"""
+
+    @abc.abstractmethod
+    def stats(self):
+        """Queue depth by status, per-worker throughput and per-mode consensus hit rate"""
+
+
+# ========== SQLITE BACKEND ==========
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode TEXT NOT NULL,
+    question TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status_message_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    progress TEXT,
+    progress_delivered TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    claimed_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    delivered_at REAL,
+    delivery_attempts INTEGER NOT NULL DEFAULT 0,
+    parts_delivered INTEGER NOT NULL DEFAULT 0,
+    trace_id TEXT,
+    parent_span_id TEXT,
+    escalated_from INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+# Columns added after the first release, for queues created by older versions
+MIGRATIONS = {
+    "trace_id": "ALTER TABLE jobs ADD COLUMN trace_id TEXT",
+    "parent_span_id": "ALTER TABLE jobs ADD COLUMN parent_span_id TEXT",
+    "escalated_from": "ALTER TABLE jobs ADD COLUMN escalated_from INTEGER",
+    "parts_delivered": "ALTER TABLE jobs ADD COLUMN parts_delivered INTEGER NOT NULL DEFAULT 0",
+}
+
+
+class SQLiteJobQueue(JobQueue):
+    """SQLite backend, safe for several worker processes on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+        for column, sql in MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(sql)
+
+    @classmethod
+    def from_url(cls, url):
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return cls(url.split("://", 1)[1][1:] or "jobs.db")
+
+    def _conn(self):
+        """One connection per thread, WAL so readers never block the writer"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _execute(self, sql, params=()):
+        return self._conn().execute(sql, params)
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        if job["result"]:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def enqueue(self, mode, question, chat_id, status_message_id=None, trace_id=None, parent_span_id=None,
+                escalated_from=None):
+        cur = self._execute(
+            "INSERT INTO jobs (mode, question, chat_id, status_message_id, created_at, trace_id, parent_span_id, "
+            "escalated_from) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (mode, question, chat_id, status_message_id, time.time(), trace_id, parent_span_id, escalated_from)
+        )
+        return cur.lastrowid
+
+    def get(self, job_id):
+        return self._job(self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def claim(self, worker_id):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, claimed_at = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker_id, now, now, row["id"])
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._job(job)
+
+    def heartbeat(self, job_id):
+        self._execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def set_progress(self, job_id, text):
+        self._execute(
+            "UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ? AND status = 'running'",
+            (text, time.time(), job_id)
+        )
+
+    def complete(self, job_id, result):
+        self._execute(
+            "UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id)
+        )
+
+    def fail(self, job_id, error):
+        self._execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (str(error), time.time(), job_id)
+        )
+
+    def requeue_stale(self, lease_seconds=LEASE_SECONDS):
+        conn = self._conn()
+        now = time.time()
+        cutoff = now - lease_seconds
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker perso troppe volte', finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (now, cutoff, MAX_ATTEMPTS)
+            )
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+                (cutoff,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if cur.rowcount:
+            logger.warning(f"Requeued {cur.rowcount} stale jobs")
+        return cur.rowcount
+
+    def progress_updates(self):
+        rows = self._execute(
+            "SELECT * FROM jobs WHERE status = 'running' AND progress IS NOT NULL "
+            "AND progress IS NOT progress_delivered"
+        ).fetchall()
+        return [self._job(r) for r in rows]
+
+    def mark_progress_delivered(self, job_id, text):
+        self._execute("UPDATE jobs SET progress_delivered = ? WHERE id = ?", (text, job_id))
+
+    def finished(self, limit=20):
+        rows = self._execute(
+            "SELECT * FROM jobs WHERE status IN ('done', 'failed') AND delivered_at IS NULL ORDER BY id LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [self._job(r) for r in rows]
+
+    def mark_part_delivered(self, job_id, part):
+        self._execute("UPDATE jobs SET parts_delivered = ? WHERE id = ?", (part, job_id))
+
+    def mark_delivered(self, job_id):
+        self._execute("UPDATE jobs SET delivered_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def delivery_failed(self, job_id):
+        self._execute(
+            "UPDATE jobs SET delivery_attempts = delivery_attempts + 1, "
+            "delivered_at = CASE WHEN delivery_attempts + 1 >= ? THEN ? END WHERE id = ?",
+            (MAX_DELIVERY_ATTEMPTS, time.time(), job_id)
+        )
+
+    def stats(self):
+        depth = {r["status"]: r["n"] for r in self._execute(
+            "SELECT status, COUNT(*) AS n FROM jobs WHERE delivered_at IS NULL GROUP BY status"
+        )}
+        oldest = self._execute("SELECT MIN(created_at) AS t FROM jobs WHERE status = 'queued'").fetchone()["t"]
+
+        since = time.time() - THROUGHPUT_WINDOW_SECONDS
+        workers = {}
+        for r in self._execute(
+            "SELECT worker, status, COUNT(*) AS n, AVG(finished_at - claimed_at) AS avg_s "
+            "FROM jobs WHERE finished_at >= ? AND worker IS NOT NULL GROUP BY worker, status",
+            (since,)
+        ):
+            w = workers.setdefault(r["worker"], {"done": 0, "failed": 0, "avg_seconds": None})
+            w[r["status"]] = r["n"]
+            if r["status"] == "done":
+                w["avg_seconds"] = round(r["avg_s"], 1)
+        for w in workers.values():
+            w["jobs_per_hour"] = w["done"] * 3600 / THROUGHPUT_WINDOW_SECONDS
+
+        # Syntheses skipped because the agents agreed, from every worker's results
+        consensus = {}
+        for r in self._execute(
+            "SELECT mode, COUNT(*) AS checked, COALESCE(SUM(json_extract(result, '$.synthesis_skipped')), 0) AS skipped, "
+            "AVG(json_extract(result, '$.consensus')) AS avg_score FROM jobs "
+            "WHERE status = 'done' AND finished_at >= ? AND json_extract(result, '$.consensus') IS NOT NULL "
+            "GROUP BY mode",
+            (since,)
+        ):
+            consensus[r["mode"]] = {
+                "checked": r["checked"],
+                "skipped": r["skipped"],
+                "hit_rate": round(r["skipped"] / r["checked"], 3),
+                "avg_score": round(r["avg_score"], 3),
+            }
+
+        return {
+            "queued": depth.get("queued", 0),
+            "running": depth.get("running", 0),
+            "undelivered": depth.get("done", 0) + depth.get("failed", 0),
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            "workers": workers,
+            "consensus": consensus,
+        }
+
+
+# ========== BACKENDS ==========
+QUEUE_BACKENDS = {
+    "sqlite": SQLiteJobQueue,
+}
+
+
+def register_backend(scheme, cls):
+    """Plug in another JobQueue implementation (cls.from_url(url) builds it)"""
+    QUEUE_BACKENDS[scheme] = cls
+
+
+def open_queue(url=JOB_QUEUE_URL):
+    """Open the queue described by url, e.g. sqlite:///jobs.db"""
+    scheme = url.split("://", 1)[0]
+    if scheme not in QUEUE_BACKENDS:
+        raise ValueError(f"Unknown job queue backend: {scheme!r}")
+    return QUEUE_BACKENDS[scheme].from_url(url)
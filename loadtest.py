@@ -0,0 +1,349 @@
+"""Concurrent-user load test for the Telegram handlers.
+
+Drives quick/standard/deep/expert commands and plain messages through the
+real handlers, job queue, workers and delivery loop, with Telegram replaced
+by an in-process stub and Groq by a local fake server. Ramps virtual users
+step by step and reports throughput, latency percentiles, event-loop lag
+and error rates for each step.
+
+    python loadtest.py --users 1,2,5,10,20 --duration 30 \\
+        --mix quick=0.4,standard=0.4,deep=0.1,expert=0.05,message=0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+QUESTIONS = [
+    "Pro e contro del lavoro remoto?",
+    "Conviene comprare casa o restare in affitto?",
+    "Come funziona la blockchain?",
+    "Quali rischi ha un investimento in una startup?",
+    "Dovrei imparare Rust o Go?",
+]
+
+DEFAULT_MIX = "quick=0.4,standard=0.4,deep=0.1,expert=0.05,message=0.05"
+
+
+# ========== FAKE GROQ ==========
+def start_fake_groq(latency, error_rate):
+    """Local chat-completions server with Groq-like latency, headers and errors"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(405)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(random.uniform(0.5, 1.5) * latency)
+
+            if random.random() < error_rate:
+                status = random.choice([429, 500])
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("retry-after", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            answer = f"Risposta simulata di {body['model']}. " * 20
+            payload = json.dumps({
+                "choices": [{"message": {"content": answer}}],
+                "usage": {"total_tokens": 300}
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("x-ratelimit-limit-requests", "14400")
+            self.send_header("x-ratelimit-remaining-requests", "14000")
+            self.send_header("x-ratelimit-reset-requests", "2m59.56s")
+            self.send_header("x-ratelimit-limit-tokens", "1000000")
+            self.send_header("x-ratelimit-remaining-tokens", "900000")
+            self.send_header("x-ratelimit-reset-tokens", "7.66s")
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-groq", daemon=True).start()
+    return server
+
+
+# ========== STUB TELEGRAM ==========
+class StubBot:
+    """Records what the bot sends; answers wake the waiting virtual user.
+
+    An answer is matched to its request by the status message: the bot
+    replies with it when the job is queued and deletes it right before
+    sending the answer. A late answer to a request that already timed out
+    deletes a status message nobody waits on any more, so it is dropped
+    instead of resolving the user's next request.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.next_id = 1
+        self.unbound = {}
+        self.waiters = {}
+        self.answering = {}
+        self.api_calls = 0
+
+    async def _call(self):
+        self.api_calls += 1
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+    def _message(self, chat_id, text):
+        self.next_id += 1
+        return StubMessage(self, chat_id, self.next_id, text)
+
+    def expect_answer(self, chat_id):
+        """Future for the answer to the next request from chat_id (bound to its status message)"""
+        future = asyncio.get_running_loop().create_future()
+        self.unbound[chat_id] = future
+        return future
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        # Only the delivery loop calls send_message directly: this is the answer
+        await self._call()
+        future = self.waiters.pop((chat_id, self.answering.pop(chat_id, None)), None)
+        if future is not None and not future.done():
+            future.set_result(text)
+        return self._message(chat_id, text)
+
+    async def reply(self, chat_id, text):
+        await self._call()
+        message = self._message(chat_id, text)
+        # The first reply to a request is its status message
+        future = self.unbound.pop(chat_id, None)
+        if future is not None:
+            self.waiters[(chat_id, message.message_id)] = future
+        return message
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._call()
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call()
+        # The delivery loop deletes the status message right before the answer
+        self.answering[chat_id] = message_id
+        return True
+
+
+class StubMessage:
+    def __init__(self, bot, chat_id, message_id, text):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+
+    async def reply_text(self, text, parse_mode=None, **kwargs):
+        return await self.bot.reply(self.chat_id, text)
+
+    async def edit_text(self, text, parse_mode=None, **kwargs):
+        await self.bot.edit_message_text(text, self.chat_id, self.message_id)
+
+    async def delete(self):
+        await self.bot.delete_message(self.chat_id, self.message_id)
+
+
+def make_update(bot, chat_id, text):
+    message = StubMessage(bot, chat_id, 0, text)
+    return SimpleNamespace(
+        message=message,
+        effective_message=message,
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(id=chat_id)
+    )
+
+
+# ========== MEASUREMENT ==========
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+async def sample_loop_lag(samples, stop, interval=0.05):
+    """How late the loop wakes a sleeping task = time other callbacks held it"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(loop.time() - start - interval, 0.0))
+
+
+async def virtual_user(bot, handlers, mix, chat_id, deadline, timeout, think_time, results):
+    """Send requests back to back until the step ends"""
+    modes, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        mode = random.choices(modes, weights)[0]
+        question = random.choice(QUESTIONS)
+        update = make_update(bot, chat_id, question)
+        context = SimpleNamespace(args=question.split())
+
+        answer = bot.expect_answer(chat_id)
+        start = time.monotonic()
+        try:
+            await handlers[mode](update, context)
+            text = await asyncio.wait_for(answer, timeout)
+            outcome = "error" if text.startswith("❌") else ("api_error" if "Errore API" in text else "ok")
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        except Exception:
+            outcome = "error"
+        results.append((mode, outcome, time.monotonic() - start))
+
+        if think_time:
+            await asyncio.sleep(random.expovariate(1 / think_time))
+
+
+async def run_step(bot, handlers, mix, users, duration, timeout, think_time):
+    results, lag = [], []
+    stop_lag = asyncio.Event()
+    lag_task = asyncio.create_task(sample_loop_lag(lag, stop_lag))
+
+    start = time.monotonic()
+    deadline = start + duration
+    await asyncio.gather(*(
+        virtual_user(bot, handlers, mix, 100000 + i, deadline, timeout, think_time, results)
+        for i in range(users)
+    ))
+    elapsed = time.monotonic() - start
+
+    stop_lag.set()
+    await lag_task
+
+    latencies = [seconds for _, outcome, seconds in results if outcome in ("ok", "api_error")]
+    failed = sum(1 for _, outcome, _ in results if outcome != "ok")
+    return {
+        "users": users,
+        "requests": len(results),
+        "throughput_rps": round(len(results) / elapsed, 3),
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p90": round(percentile(latencies, 90), 3),
+        "latency_p99": round(percentile(latencies, 99), 3),
+        "latency_max": round(max(latencies, default=0.0), 3),
+        "loop_lag_p99": round(percentile(lag, 99) * 1000, 1),
+        "loop_lag_max": round(max(lag, default=0.0) * 1000, 1),
+        "error_rate": round(failed / len(results), 4) if results else 0.0,
+        "outcomes": {o: sum(1 for _, outcome, _ in results if outcome == o)
+                     for o in ("ok", "api_error", "error", "timeout")},
+        "by_mode": {m: round(percentile([s for mode, o, s in results if mode == m], 50), 3)
+                    for m in mix},
+    }
+
+
+def print_step(step):
+    print(
+        f"{step['users']:>5} {step['requests']:>8} {step['throughput_rps']:>8.2f} "
+        f"{step['latency_p50']:>7.2f} {step['latency_p90']:>7.2f} {step['latency_p99']:>7.2f} "
+        f"{step['latency_max']:>7.2f} {step['loop_lag_p99']:>8.1f} {step['loop_lag_max']:>8.1f} "
+        f"{step['error_rate'] * 100:>6.1f}%",
+        flush=True
+    )
+
+
+# ========== MAIN ==========
+def parse_mix(raw):
+    mix = {}
+    for item in raw.split(","):
+        mode, _, weight = item.partition("=")
+        mix[mode.strip()] = float(weight)
+    return mix
+
+
+async def run(args):
+    import telegram_bot
+
+    # The bot logs every job; keep the report readable
+    logging.getLogger().setLevel(logging.WARNING)
+
+    handlers = {
+        "quick": telegram_bot.quick_command,
+        "standard": telegram_bot.standard_command,
+        "deep": telegram_bot.deep_command,
+        "expert": telegram_bot.expert_command,
+        "panel": telegram_bot.panel_command,
+        "message": telegram_bot.handle_message,
+    }
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - set(handlers)
+    if unknown:
+        raise SystemExit(f"Unknown modes in --mix: {', '.join(sorted(unknown))}")
+
+    bot = StubBot(args.telegram_latency)
+    stop_workers = threading.Event()
+    telegram_bot.start_workers(
+        telegram_bot.JOB_QUEUE, args.workers, stop_workers, prefix="loadtest", history=telegram_bot.HISTORY
+    )
+    delivery = asyncio.create_task(telegram_bot.deliver_results(bot))
+
+    print(f"{'users':>5} {'requests':>8} {'req/s':>8} {'p50':>7} {'p90':>7} {'p99':>7} "
+          f"{'max':>7} {'lag99ms':>8} {'lagmaxms':>8} {'errors':>7}")
+    report = []
+    for users in args.users:
+        step = await run_step(bot, handlers, mix, users, args.duration, args.timeout, args.think_time)
+        print_step(step)
+        report.append(step)
+
+    delivery.cancel()
+    stop_workers.set()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "steps": report}, f, indent=2, default=str)
+        print(f"Report written to {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Telegram handlers")
+    parser.add_argument("--users", default="1,2,5,10,20",
+                        help="virtual users per step, comma separated (default 1,2,5,10,20)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per step")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="mode weights, e.g. quick=0.5,deep=0.5")
+    parser.add_argument("--workers", type=int, default=4, help="pipeline worker threads")
+    parser.add_argument("--groq-latency", type=float, default=0.5, help="mean fake Groq latency (s)")
+    parser.add_argument("--groq-error-rate", type=float, default=0.0, help="fraction of 429/500 replies")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="mean stub Telegram latency (s)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's requests (s)")
+    parser.add_argument("--timeout", type=float, default=300, help="give up on an answer after (s)")
+    parser.add_argument("--keys", type=int, default=2, help="fake Groq API keys in the pool")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    args.users = [int(u) for u in args.users.split(",")]
+
+    server = start_fake_groq(args.groq_latency, args.groq_error_rate)
+
+    # Configuration is read at import time, so set it before importing the bot
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["TELEGRAM_TOKEN"] = "loadtest"
+    os.environ["GROQ_API_KEYS"] = ",".join(f"loadtest-key-{i:04d}" for i in range(args.keys))
+    os.environ.pop("GROQ_API_KEY", None)
+    os.environ["GROQ_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/openai/v1/chat/completions"
+    os.environ["JOB_QUEUE_URL"] = f"sqlite:///{os.path.join(workdir, 'jobs.db')}"
+    os.environ["HISTORY_DB"] = os.path.join(workdir, "history.db")
+    os.environ.setdefault("TRACE_FILE", "")
+    print(f"Fake Groq on port {server.server_address[1]}, queue in {workdir}", file=sys.stderr)
+
+    asyncio.run(run(args))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import logging
+from synthesis import PANEL_AGENTS, query_panel, tree_synthesize
+from groq_pool import GroqKeyPool
+from tracing import span
+from escalation import take
+from consensus import find_consensus
+
+logger = logging.getLogger(__name__)
+
+# Groq keys from GROQ_API_KEYS (comma separated) and/or GROQ_API_KEY
+GROQ_POOL = GroqKeyPool.from_env()
+
+
+# Groq API helper
+def query_groq(model, system_msg, user_msg):
+    """Query Groq API through the key pool"""
+    data = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": user_msg}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 1024
+    }
+
+    try:
+        result = GROQ_POOL.chat(data, timeout=60)
+        return result["choices"][0]["message"]["content"]
+    except Exception as e:
+        logger.error(f"Groq API error: {e}")
+        return f"Errore API: {str(e)}"
+
+
+def _no_progress(text):
+    pass
+
+
+def ask_agent(model, role, system_msg, domanda, reuse=None):
+    """One agent answer, taken from reuse when an earlier mode already asked this model.
+
+    Returns (answer, reused).
+    """
+    with span("agent", role=role, model=model) as s:
+        answer = take(reuse, model)
+        s.set("reused", answer is not None)
+        if answer is not None:
+            return answer, True
+        return query_groq(model, system_msg, domanda), False
+
+
+def _consensus_note(agreed, score):
+    return f"\n🤝 Agenti concordi (consenso {score:.2f}): sintesi non necessaria" if agreed else ""
+
+
+def _reuse_note(reused):
+    return f"\n♻️ {reused} risposte riutilizzate dalla modalità precedente" if reused else ""
+
+
+# Every pipeline takes the question, a progress(text) callback and optionally
+# reuse ({model: [answer, ...]} from escalation.build_reuse), and returns
+# {"text": final message, "answer": final answer, "agents": [(role, model, answer), ...], "reused": n,
+#  "consensus": agreement score or None when not checked, "synthesis_skipped": bool}
+
+# ========== QUICK MODE ==========
+def run_quick(domanda, progress=_no_progress, reuse=None):
+    """Quick mode - 1 model"""
+    model = "llama-3.3-70b-versatile"
+    risposta, reused = ask_agent(
+        model,
+        "Esperto Generalista",
+        "Sei un esperto generalista. Fornisci risposta completa e chiara.",
+        domanda,
+        reuse
+    )
+
+    final_msg = f"🟢 *QUICK - Risposta:*\n\n{risposta}\n\n💰 1 modello"
+    return {"text": final_msg, "answer": risposta, "agents": [("Esperto Generalista", model, risposta)],
+            "reused": int(reused), "consensus": None,
+            "synthesis_skipped": False}
+
+# ========== STANDARD MODE ==========
+def run_standard(domanda, progress=_no_progress, reuse=None):
+    """Standard mode - 3 models"""
+    agents = [
+        ("llama-3.1-8b-instant", "Analista Tecnico", "Analisi dettagliata"),
+        ("openai/gpt-oss-20b", "Esperto Pratico", "Esempi concreti e soluzioni pratiche"),
+        ("qwen/qwen3-32b", "Pensatore Critico", "Analisi critica e prospettive alternative")
+    ]
+
+    responses = []
+    reused = 0
+    for model, role, goal in agents:
+        r, was_reused = ask_agent(model, role, f"Sei un {role}. {goal}.", domanda, reuse)
+        reused += was_reused
+        responses.append((role, model, r))
+
+    # Agents already agree: skip the synthesis call
+    finale, score = find_consensus("standard", [r for _, _, r in responses])
+    agreed = finale is not None
+    if not agreed:
+        # Synthesis
+        with span("prompt.build", inputs=len(responses)):
+            synthesis_prompt = "Sintetizza queste 3 analisi:\n\n"
+            for role, _, resp in responses:
+                synthesis_prompt += f"{role}: {resp}\n\n"
+
+        with span("synthesis", model="llama-3.3-70b-versatile", inputs=len(responses), prompt_chars=len(synthesis_prompt)):
+            finale = query_groq(
+                "llama-3.3-70b-versatile",
+                "Sintetizza le analisi in una risposta coerente e completa.",
+                synthesis_prompt
+            )
+
+    final_msg = f"🟡 *STANDARD - Risposta Sintetizzata:*\n\n{finale}\n\n"
+    final_msg += "📊 *Dettagli:* 3 modelli consultati" + _reuse_note(reused) + _consensus_note(agreed, score)
+    return {"text": final_msg, "answer": finale, "agents": responses, "reused": reused,
+            "consensus": score, "synthesis_skipped": agreed}
+
+# ========== DEEP MODE ==========
+def run_deep(domanda, progress=_no_progress, reuse=None):
+    """Deep mode - 5 models"""
+    agents = [
+        ("llama-3.1-8b-instant", "Analista Veloce"),
+        ("llama-3.3-70b-versatile", "Stratega"),
+        ("openai/gpt-oss-20b", "Esperto Pratico"),
+        ("qwen/qwen3-32b", "Pensatore Alternativo"),
+        ("meta-llama/llama-4-scout-17b-16e-instruct", "Verificatore Moderno")
+    ]
+
+    responses = []
+    reused = 0
+    for i, (model, role) in enumerate(agents, 1):
+        progress(f"🟠 *Modalità DEEP*\n⏳ Agente {i}/5: {role}...")
+        r, was_reused = ask_agent(model, role, f"Sei un {role}.", domanda, reuse)
+        reused += was_reused
+        responses.append((role, model, r))
+
+    progress("🟠 *Modalità DEEP*\n🎯 Sintetizzazione finale...")
+
+    # Agents already agree: skip the synthesis call
+    finale, score = find_consensus("deep", [r for _, _, r in responses])
+    agreed = finale is not None
+    if not agreed:
+        # Synthesis
+        with span("prompt.build", inputs=len(responses)):
+            synthesis_prompt = "Crea sintesi definitiva da queste 5 analisi:\n\n"
+            for role, _, resp in responses:
+                synthesis_prompt += f"{role}: {resp}\n\n"
+
+        with span("synthesis", model="openai/gpt-oss-120b", inputs=len(responses), prompt_chars=len(synthesis_prompt)):
+            finale = query_groq(
+                "openai/gpt-oss-120b",
+                "Crea sintesi completa e bilanciata da tutte le prospettive.",
+                synthesis_prompt
+            )
+
+    final_msg = f"🟠 *DEEP - Risposta da 5 Prospettive:*\n\n{finale}\n\n"
+    final_msg += "📊 *5 modelli premium consultati*" + _reuse_note(reused) + _consensus_note(agreed, score)
+    return {"text": final_msg, "answer": finale, "agents": responses, "reused": reused,
+            "consensus": score, "synthesis_skipped": agreed}
+
+# ========== EXPERT MODE ==========
+def run_expert(domanda, progress=_no_progress, reuse=None):
+    """Expert mode - 6 models"""
+    agents = [
+        ("llama-3.1-8b-instant", "Analista Veloce"),
+        ("llama-3.3-70b-versatile", "Stratega Master"),
+        ("openai/gpt-oss-120b", "Pensatore Profondo"),
+        ("openai/gpt-oss-20b", "Esperto Pratico"),
+        ("qwen/qwen3-32b", "Critico Costruttivo"),
+        ("meta-llama/llama-guard-4-12b", "Verificatore Globale")
+    ]
+
+    responses = []
+    reused = 0
+    for i, (model, role) in enumerate(agents, 1):
+        progress(f"🔴 *Modalità EXPERT*\n⏳ Agente {i}/6: {role}...")
+        r, was_reused = ask_agent(model, role, f"Sei un {role}.", domanda, reuse)
+        reused += was_reused
+        responses.append((role, model, r))
+
+    progress("🔴 *Modalità EXPERT*\n🎯 Super-sintesi master in corso...")
+
+    # Agents already agree: skip the synthesis call
+    finale, score = find_consensus("expert", [r for _, _, r in responses])
+    agreed = finale is not None
+    if not agreed:
+        # Master synthesis
+        with span("prompt.build", inputs=len(responses)):
+            synthesis_prompt = "Crea sintesi definitiva master da queste 6 analisi esperte:\n\n"
+            for role, _, resp in responses:
+                synthesis_prompt += f"{role}: {resp}\n\n"
+
+        with span("synthesis", model="openai/gpt-oss-120b", inputs=len(responses), prompt_chars=len(synthesis_prompt)):
+            finale = query_groq(
+                "openai/gpt-oss-120b",
+                "Crea sintesi definitiva master integrando tutte le prospettive.",
+                synthesis_prompt
+            )
+
+    final_msg = f"🔴 *EXPERT - Risposta Master da 6 AI:*\n\n{finale}\n\n"
+    final_msg += "📊 *6 modelli top-tier consultati*" + _reuse_note(reused) + _consensus_note(agreed, score)
+    return {"text": final_msg, "answer": finale, "agents": responses, "reused": reused,
+            "consensus": score, "synthesis_skipped": agreed}
+
+# ========== PANEL MODE ==========
+def run_panel(domanda, progress=_no_progress, reuse=None):
+    """Panel mode - 12 perspectives with hierarchical synthesis (not an escalation target)"""
+    n = len(PANEL_AGENTS)
+
+    responses = query_panel(query_groq, PANEL_AGENTS, domanda)
+
+    progress("🟣 *Modalità PANEL*\n🎯 Sintesi gerarchica in corso...")
+
+    finale = tree_synthesize(
+        query_groq,
+        domanda,
+        responses,
+        "openai/gpt-oss-120b",
+        "Crea sintesi definitiva integrando tutte le prospettive del panel.",
+        f"Crea sintesi definitiva da queste analisi di un panel di {n} esperti:"
+    )
+
+    final_msg = f"🟣 *PANEL - Risposta da {n} Prospettive:*\n\n{finale}\n\n"
+    final_msg += f"📊 *{n} prospettive, sintesi gerarchica*"
+    agents = [(role, model, resp) for (model, _), (role, resp) in zip(PANEL_AGENTS, responses)]
+    return {"text": final_msg, "answer": finale, "agents": agents, "reused": 0, "consensus": None,
+            "synthesis_skipped": False}
+
+
+PIPELINES = {
+    "quick": run_quick,
+    "standard": run_standard,
+    "deep": run_deep,
+    "expert": run_expert,
+    "panel": run_panel,
+}
@@ -0,0 +1,322 @@
+import os
+import sys
+import hmac
+import time
+import marshal
+import asyncio
+import logging
+import threading
+import traceback
+import functools
+import concurrent.futures
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# ========== CONFIGURATION ==========
+# Event loop heartbeat, and how long it may be late before the blocking stack is captured
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.1))
+LOOP_STALL_SECONDS = float(os.getenv('LOOP_STALL_SECONDS', 0.25))
+LAG_WINDOW = 600
+MAX_STALLS = 20
+
+# /debug/* endpoints are off unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', "")
+PROFILE_INTERVAL = 0.01
+PROFILE_MAX_SECONDS = 120
+# "cpu": only threads that used CPU since the last sample; "wall": every thread, blocked or not
+PROFILE_MODES = ("cpu", "wall")
+
+
+# ========== EVENT LOOP LAG ==========
+class LoopLagMonitor:
+    """Measures how late the event loop runs and catches what blocks it.
+
+    A task on the loop wakes every interval and records how late it woke.
+    A watchdog thread notices when that task has not run for stall_seconds
+    and grabs the loop thread's stack while the blocking callback is still
+    running, so the culprit shows up in the log and in stalls().
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, stall_seconds=LOOP_STALL_SECONDS):
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.loop = None
+        self.loop_thread_id = None
+        self.lock = threading.Lock()
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.recent_stalls = deque(maxlen=MAX_STALLS)
+        self.stall_count = 0
+        self.current = None
+        self.last_beat = None
+
+    def start(self):
+        """Start monitoring the running loop. Call from a coroutine on that loop"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.loop.create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def _beat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - before - self.interval, 0.0)
+            with self.lock:
+                self.lags.append(lag)
+                self.last_beat = now
+                stall, self.current = self.current, None
+            if stall is not None:
+                stall["blocked_seconds"] = round(lag, 3)
+                logger.warning(f"Event loop was blocked for {lag:.2f}s")
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval / 2)
+            with self.lock:
+                blocked = time.monotonic() - self.last_beat - self.interval
+                if blocked < self.stall_seconds or self.current is not None:
+                    continue
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                self.current = {"at": time.time(), "blocked_seconds": None, "stack": stack}
+                self.recent_stalls.append(self.current)
+                self.stall_count += 1
+            logger.warning(f"Event loop blocked for {blocked:.2f}s so far, running:\n{stack}")
+
+    def report(self):
+        """Lag percentiles over the last LAG_WINDOW beats and stall counts"""
+        with self.lock:
+            lags = sorted(self.lags)
+            stalls = list(self.recent_stalls)
+
+        def ms(p):
+            return round(lags[min(int(len(lags) * p), len(lags) - 1)] * 1000, 1) if lags else None
+
+        return {
+            "running": self.loop is not None,
+            "lag_ms_p50": ms(0.5),
+            "lag_ms_p99": ms(0.99),
+            "lag_ms_max": round(lags[-1] * 1000, 1) if lags else None,
+            "stalls": self.stall_count,
+            "recent_stalls": [{"at": s["at"], "blocked_seconds": s["blocked_seconds"]} for s in stalls],
+        }
+
+    def stalls(self):
+        """Recent stalls with the stack that was running, newest last"""
+        with self.lock:
+            return [dict(s) for s in self.recent_stalls]
+
+
+LOOP_MONITOR = LoopLagMonitor()
+
+
+# ========== SAMPLING PROFILER ==========
+def _short(filename):
+    """Path relative to the sys.path entry it was imported from"""
+    best = filename
+    for entry in sys.path:
+        if entry and filename.startswith(entry + os.sep) and len(filename) - len(entry) - 1 < len(best):
+            best = filename[len(entry) + 1:]
+    return best
+
+
+def _frames(frame):
+    """(file, first line, function) of every frame, root first"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append((_short(code.co_filename), code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+def thread_cpu_ticks(native_id):
+    """utime + stime of one thread of this process in clock ticks, None without Linux /proc"""
+    try:
+        with open(f"/proc/self/task/{native_id}/stat") as f:
+            # Fields after "(comm)", which may itself contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL, mode="cpu"):
+    """Sample the stack of every thread but the caller's.
+
+    In wall mode every thread counts, so threads parked in a lock, a
+    socket or the event loop's select() swamp the profile. In cpu mode a
+    thread is only sampled when its CPU time went up since the previous
+    sample (/proc/self/task/<native_id>/stat); without /proc it falls
+    back to wall.
+
+    Returns a Counter of (thread name, frames) -> samples.
+    """
+    me = threading.get_ident()
+    if mode == "cpu" and thread_cpu_ticks(threading.get_native_id()) is None:
+        logger.warning("No per-thread CPU times here, profiling wall-clock instead")
+        mode = "wall"
+    samples = Counter()
+    last_ticks = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        threads = {t.ident: t for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            t = threads.get(ident)
+            if mode == "cpu":
+                ticks = thread_cpu_ticks(t.native_id) if t else None
+                busy = ticks is not None and ident in last_ticks and ticks > last_ticks[ident]
+                last_ticks[ident] = ticks
+                if not busy:
+                    continue
+            samples[(t.name if t else str(ident), _frames(frame))] += 1
+        time.sleep(interval)
+    return samples
+
+
+def _label(func):
+    filename, line, name = func
+    return f"{name} ({filename}:{line})"
+
+
+def to_collapsed(samples):
+    """Brendan Gregg's collapsed stacks: flamegraph.pl, speedscope, inferno"""
+    lines = []
+    for (thread, frames), count in samples.most_common():
+        stack = ";".join([thread.replace(";", ":")] + [_label(f).replace(";", ":") for f in frames])
+        lines.append(f"{stack} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def to_pstats(samples, interval=PROFILE_INTERVAL):
+    """marshal'ed pstats data: python -m pstats, snakeviz.
+
+    Call counts are sample counts; times are samples * interval.
+    """
+    stats = {}
+    for (_, frames), count in samples.items():
+        seconds = count * interval
+        seen = set()
+        for i, func in enumerate(frames):
+            entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+            leaf = i == len(frames) - 1
+            entry[1] += count
+            if func not in seen:
+                # Recursive frames count once towards cumulative time
+                seen.add(func)
+                entry[0] += count
+                entry[3] += seconds
+            if leaf:
+                entry[2] += seconds
+            if i:
+                caller = entry[4].setdefault(frames[i - 1], [0, 0, 0.0, 0.0])
+                caller[0] += count
+                caller[1] += count
+                caller[3] += seconds
+                if leaf:
+                    caller[2] += seconds
+    return marshal.dumps({
+        func: (cc, nc, tt, ct, {caller: tuple(c) for caller, c in callers.items()})
+        for func, (cc, nc, tt, ct, callers) in stats.items()
+    })
+
+
+# ========== STACK DUMP ==========
+def thread_stacks():
+    """Current stack of every thread, like py-spy dump"""
+    threads = {t.ident: t for t in threading.enumerate()}
+    out = []
+    for ident, frame in sys._current_frames().items():
+        t = threads.get(ident)
+        name = f"{t.name}{' (daemon)' if t.daemon else ''}" if t else "?"
+        out.append(f"Thread {ident} {name}\n" + "".join(traceback.format_stack(frame)))
+    return "\n".join(out)
+
+
+def _format_tasks(tasks):
+    out = []
+    for task in tasks:
+        state = "done" if task.done() else "pending"
+        stack = traceback.StackSummary.extract((f, f.f_lineno) for f in task.get_stack())
+        out.append(f"Task {task.get_name()} {state} {task.get_coro()!r}\n" + "".join(stack.format()))
+    return "\n".join(out)
+
+
+def task_stacks(loop, timeout=1.0):
+    """Every asyncio task on loop with where it is suspended"""
+    async def collect():
+        return _format_tasks(asyncio.all_tasks())
+
+    future = asyncio.run_coroutine_threadsafe(collect(), loop)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        # The loop is stuck (which is why you are looking): read its tasks from here
+        return "# event loop unresponsive, tasks read from outside the loop\n" + _format_tasks(asyncio.all_tasks(loop))
+
+
+# ========== ADMIN ENDPOINTS ==========
+def add_debug_routes(app, monitor=LOOP_MONITOR, token=ADMIN_TOKEN):
+    """/debug/profile, /debug/stacks and /debug/stalls on a Flask app.
+
+    Admin only: the token goes in the X-Admin-Token header, never in the
+    URL, which the server logs. Without a token configured the routes answer 404.
+    """
+    from flask import request, abort, Response
+
+    profile_lock = threading.Lock()
+
+    def admin_only(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            if not token:
+                abort(404)
+            given = request.headers.get("X-Admin-Token", "")
+            if not hmac.compare_digest(given.encode(), token.encode()):
+                abort(403)
+            return view(*args, **kwargs)
+        return wrapped
+
+    @app.route('/debug/profile')
+    @admin_only
+    def debug_profile():
+        """?seconds=10&format=collapsed|pstats&mode=cpu|wall"""
+        seconds = min(max(request.args.get("seconds", 10, type=float), 0.1), PROFILE_MAX_SECONDS)
+        fmt = request.args.get("format", "collapsed")
+        mode = request.args.get("mode", "cpu")
+        if fmt not in ("collapsed", "pstats") or mode not in PROFILE_MODES:
+            abort(400)
+        if not profile_lock.acquire(blocking=False):
+            return {"error": "profile already running"}, 409
+        try:
+            logger.info(f"Profiling for {seconds}s ({mode}, {fmt})")
+            samples = sample_stacks(seconds, mode=mode)
+        finally:
+            profile_lock.release()
+        if fmt == "pstats":
+            return Response(to_pstats(samples), mimetype="application/octet-stream",
+                            headers={"Content-Disposition": "attachment; filename=profile.pstats"})
+        return Response(to_collapsed(samples), mimetype="text/plain",
+                        headers={"Content-Disposition": "attachment; filename=profile.collapsed"})
+
+    @app.route('/debug/stacks')
+    @admin_only
+    def debug_stacks():
+        """Thread stacks and asyncio tasks, as text"""
+        text = "# Threads\n\n" + thread_stacks()
+        if monitor.loop is not None:
+            text += "\n\n# Asyncio tasks\n\n" + task_stacks(monitor.loop)
+        return Response(text, mimetype="text/plain")
+
+    @app.route('/debug/stalls')
+    @admin_only
+    def debug_stalls():
+        """Recent event loop stalls with the stack that blocked it"""
+        return {"stalls": monitor.stalls(), "loop": monitor.report()}
@@ -0,0 +1,65 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age():
+    """Seconds since the process was created (Linux only, else None)"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the ")" that closes the command name
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """Break boot time down by phase.
+
+    Call mark(name) at the end of each phase; the phase lasts from the
+    previous mark. Time spent before this module was imported (interpreter
+    and framework start) is reported as the "interpreter" phase.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        age = _process_age()
+        if age is not None:
+            self.phases.append(("interpreter", age))
+        self.done = False
+
+    def mark(self, name):
+        if self.done:
+            # Streamlit reruns the script; only the first run is startup
+            return
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def report(self):
+        return {
+            "total_seconds": round(self.total(), 3),
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases},
+        }
+
+    def finish(self, name="ready"):
+        """Close the last phase and log the breakdown once"""
+        if self.done:
+            return
+        self.mark(name)
+        self.done = True
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        logger.info(f"Startup: {self.total():.2f}s ({breakdown})")
+
+
+STARTUP = StartupTimer()
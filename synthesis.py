@@ -0,0 +1,152 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from tracing import span, bind
+
+logger = logging.getLogger(__name__)
+
+# ========== CONFIGURATION ==========
+# Reduction levels as "model:fan_in" pairs, first level first.
+# The last level is reused if more reductions are needed.
+DEFAULT_SYNTHESIS_LEVELS = "llama-3.1-8b-instant:3,openai/gpt-oss-20b:3"
+
+# Max number of (partial) answers handed to the final synthesizer
+FINAL_FAN_IN = int(os.getenv('SYNTHESIS_FINAL_FAN_IN', 4))
+
+# Max parallel Groq calls per level
+MAX_WORKERS = int(os.getenv('SYNTHESIS_MAX_WORKERS', 6))
+
+# The PANEL mode's perspectives (model, role), shared by the bot and the web app
+PANEL_AGENTS = [
+    ("llama-3.1-8b-instant", "Analista Tecnico"),
+    ("llama-3.1-8b-instant", "Economista"),
+    ("openai/gpt-oss-20b", "Esperto Pratico"),
+    ("openai/gpt-oss-20b", "Giurista"),
+    ("qwen/qwen3-32b", "Pensatore Critico"),
+    ("qwen/qwen3-32b", "Avvocato del Diavolo"),
+    ("meta-llama/llama-4-scout-17b-16e-instruct", "Psicologo"),
+    ("meta-llama/llama-4-scout-17b-16e-instruct", "Storico"),
+    ("llama-3.3-70b-versatile", "Stratega"),
+    ("llama-3.3-70b-versatile", "Gestore del Rischio"),
+    ("openai/gpt-oss-120b", "Eticista"),
+    ("openai/gpt-oss-120b", "Innovatore")
+]
+
+MERGE_SYSTEM = (
+    "Unisci le analisi in una sintesi intermedia fedele. "
+    "Conserva punti chiave, dati concreti e disaccordi tra le analisi."
+)
+
+
+def parse_levels(raw):
+    """Parse 'model:fan_in,model:fan_in' into a list of level dicts"""
+    levels = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, fan_in = item.rpartition(":")
+        if not model or not fan_in.isdigit() or int(fan_in) < 2:
+            raise ValueError(f"Invalid synthesis level: {item!r} (expected model:fan_in, fan_in >= 2)")
+        levels.append({"model": model, "fan_in": int(fan_in)})
+    if not levels:
+        raise ValueError("SYNTHESIS_LEVELS is empty")
+    return levels
+
+
+SYNTHESIS_LEVELS = parse_levels(os.getenv('SYNTHESIS_LEVELS', DEFAULT_SYNTHESIS_LEVELS))
+
+if FINAL_FAN_IN < 2:
+    raise ValueError("SYNTHESIS_FINAL_FAN_IN must be >= 2")
+
+
+# ========== HELPERS ==========
+def format_responses(responses):
+    """Format (role, answer) pairs the way synthesis prompts expect"""
+    return "".join(f"{role}: {resp}\n\n" for role, resp in responses)
+
+
+def _is_error(text):
+    return text.startswith("Errore API")
+
+
+def _groups(items, fan_in):
+    """Split items into ceil(n / fan_in) groups of balanced size"""
+    n_groups = -(-len(items) // fan_in)
+    size, extra = divmod(len(items), n_groups)
+    groups, start = [], 0
+    for i in range(n_groups):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+def query_panel(query_fn, agents, domanda, max_workers=MAX_WORKERS):
+    """Query all (model, role) agents in parallel, keeping agent order"""
+    def ask(agent):
+        model, role = agent
+        with span("agent", role=role, model=model):
+            return role, query_fn(model, f"Sei un {role}.", domanda)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(bind(ask), agents))
+
+
+# ========== TREE REDUCE ==========
+def _merge_group(query_fn, domanda, group, model):
+    """Merge one group into a single partial answer"""
+    if len(group) == 1:
+        return list(group)
+
+    roles = [role for role, _ in group]
+    with span("prompt.build", inputs=len(group)):
+        prompt = f"Domanda: {domanda}\n\nUnisci queste {len(group)} analisi:\n\n"
+        prompt += format_responses(group)
+
+    with span("synthesis.merge", model=model, inputs=len(group), prompt_chars=len(prompt)):
+        merged = query_fn(model, MERGE_SYSTEM, prompt)
+    if _is_error(merged):
+        # Keep the raw answers rather than losing them
+        logger.warning(f"Partial synthesis failed ({model}), passing {len(group)} answers through")
+        return list(group)
+
+    return [(f"Sintesi parziale ({' + '.join(roles)})", merged)]
+
+
+def _reduce_level(query_fn, domanda, items, level, max_workers):
+    """Run one reduction level, merging groups in parallel"""
+    groups = _groups(items, level["fan_in"])
+    merge = bind(lambda g: _merge_group(query_fn, domanda, g, level["model"]))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return [item for partial in pool.map(merge, groups) for item in partial]
+
+
+def tree_synthesize(query_fn, domanda, responses, final_model, final_system, final_header,
+                    levels=None, final_fan_in=FINAL_FAN_IN, max_workers=MAX_WORKERS):
+    """Hierarchical map-reduce synthesis.
+
+    Agent answers are merged in groups of `fan_in` by the fast model of each
+    level until at most `final_fan_in` remain, then `final_model` writes the
+    answer. With few agents this is exactly one flat synthesis call.
+    """
+    levels = levels or SYNTHESIS_LEVELS
+    items = list(responses)
+
+    depth = 0
+    while len(items) > final_fan_in:
+        level = levels[min(depth, len(levels) - 1)]
+        with span("synthesis.level", level=depth + 1, model=level["model"], inputs=len(items)):
+            reduced = _reduce_level(query_fn, domanda, items, level, max_workers)
+        logger.info(f"Synthesis level {depth + 1} ({level['model']}): {len(items)} -> {len(reduced)}")
+        if len(reduced) >= len(items):
+            # Every merge failed, let the final synthesizer cope
+            break
+        items = reduced
+        depth += 1
+
+    with span("prompt.build", inputs=len(items)):
+        prompt = f"{final_header}\n\n" + format_responses(items)
+    with span("synthesis", model=final_model, inputs=len(items), prompt_chars=len(prompt)):
+        return query_fn(final_model, final_system, prompt)
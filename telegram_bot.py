@@ -1,51 +1,104 @@
+from startup import STARTUP
 import os
+import re
+import asyncio
 import logging
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-import requests
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.error import BadRequest, RetryAfter, TelegramError
 import signal
 import sys
-from flask import Flask
+import time
 import threading
-
-# Logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from pipelines import GROQ_POOL, PANEL_AGENTS
+from job_queue import open_queue
+from worker import start_workers
+from tracing import span, record_span, setup_logging
+from history import AnswerHistory
+from escalation import ESCALATION
+from profiling import LOOP_MONITOR, add_debug_routes
+from datetime import datetime
+
+STARTUP.mark("imports")
+
+# Logging (non-blocking, lines carry the trace id)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Environment variables
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 PORT = int(os.getenv('PORT', 10000))
+# Worker threads inside the bot process (0 = only external `python worker.py`)
+EMBEDDED_WORKERS = int(os.getenv('EMBEDDED_WORKERS', 2))
+DELIVERY_INTERVAL_SECONDS = 0.5
+# Telegram flood control waits per message before the delivery is retried later
+MAX_FLOOD_WAITS = 3
 
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN not set")
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY not set")
+if not GROQ_POOL:
+    raise ValueError("GROQ_API_KEY / GROQ_API_KEYS not set")
+
+# Durable queue between this front end and the pipeline workers
+JOB_QUEUE = open_queue()
+# Searchable, append-only answer history (HISTORY_DB)
+HISTORY = AnswerHistory()
+
+STARTUP.mark("config")
+
+def warn_ephemeral_storage():
+    """Warn when the queue or the history live in the working directory,
+    which Render's free tier wipes on every restart and deploy"""
+    workdir = os.getcwd() + os.sep
+    for setting, path in (("JOB_QUEUE_URL", getattr(JOB_QUEUE, "path", None)), ("HISTORY_DB", HISTORY.path)):
+        if path and path != ":memory:" and os.path.abspath(path).startswith(workdir):
+            logger.warning(
+                f"{setting} points to {os.path.abspath(path)} in the working directory: "
+                f"it is lost on restart unless that directory is on a persistent disk"
+            )
 
 # Flask app for health check (required by Render)
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "Bot is running!"
-
-@app.route('/health')
-def health():
-    return {"status": "healthy", "bot": "active"}
+def create_health_app():
+    """Build the health app. Flask is imported here, in the Flask thread,
+    so it stays off the bot's boot path."""
+    from flask import Flask
+    
+    app = Flask(__name__)
+    
+    @app.route('/')
+    def home():
+        return "Bot is running!"
+    
+    @app.route('/health')
+    def health():
+        return {"status": "healthy", "bot": "active", "groq_keys": GROQ_POOL.usage()}
+    
+    @app.route('/metrics')
+    def metrics():
+        return {
+            "queue": JOB_QUEUE.stats(),
+            "groq_keys": GROQ_POOL.usage(),
+            "event_loop": LOOP_MONITOR.report(),
+            "startup": STARTUP.report()
+        }
+    
+    # Admin only (ADMIN_TOKEN): /debug/profile, /debug/stacks, /debug/stalls
+    add_debug_routes(app)
+    
+    return app
 
 def run_flask():
     """Run Flask in background thread"""
-    app.run(host='0.0.0.0', port=PORT)
+    create_health_app().run(host='0.0.0.0', port=PORT)
 
 # Global application reference
 application = None
+workers_stop = threading.Event()
 
 def signal_handler(signum, frame):
     """Handle shutdown gracefully"""
     logger.info("Shutdown signal received")
+    workers_stop.set()
     if application:
         application.stop()
     sys.exit(0)
@@ -53,34 +106,6 @@ def signal_handler(signum, frame):
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
-# Groq API helper
-def query_groq(model, system_msg, user_msg):
-    """Query Groq API"""
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": user_msg}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 1024
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        logger.error(f"Groq API error: {e}")
-        return f"Errore API: {str(e)}"
-
 def split_message(text, max_length=4000):
     """Split long messages"""
     if len(text) <= max_length:
@@ -123,8 +148,12 @@ Consulto da 1 a 6 modelli AI in base alla complessità!
 🔴 `/expert [domanda]` - 6 modelli (120s)
    Esempio: `/expert Analizza investimento startup`
 
+🟣 `/panel [domanda]` - 12 prospettive (90s)
+   Esempio: `/panel Conviene aprire un ristorante?`
+
 *Oppure scrivi direttamente* (usa STANDARD)
 
+📚 `/history [parole]` - Cerca nelle risposte passate
 /help - Guida dettagliata
     """
     await update.message.reply_text(welcome, parse_mode='Markdown')
@@ -154,18 +183,54 @@ Comando: `/deep [domanda]`
 Usa per: decisioni critiche, massima accuratezza
 Comando: `/expert [domanda]`
 
+*🟣 PANEL (90 secondi)*
+12 prospettive in parallelo + sintesi gerarchica
+Usa per: temi con molti punti di vista
+Comando: `/panel [domanda]`
+
+*📚 STORICO*
+Ogni risposta viene salvata: ritrovala invece di richiederla
+Comando: `/history [parole]`, poi `/history #numero` per il testo completo
+
+*⬆️ APPROFONDISCI*
+Sotto ogni risposta QUICK, STANDARD o DEEP c'è un pulsante per passare alla modalità successiva: le risposte già calcolate vengono riusate, lavorano solo gli agenti mancanti
+
 *💡 Esempi:*
 `/quick Definizione di blockchain`
 `/standard Vantaggi intelligenza artificiale`
 `/deep Dovrei accettare offerta lavoro all'estero?`
 `/expert Valuta acquisizione azienda 2M€`
+`/panel Settimana corta di 4 giorni?`
 
-⏱️ Tempi: Quick 10s | Standard 30s | Deep 60s | Expert 2min
+⏱️ Tempi: Quick 10s | Standard 30s | Deep 60s | Expert 2min | Panel 90s
 💰 Costo: Sempre $0 (gratis)
 🤖 Modelli: Llama 3.3, OpenAI GPT-OSS, Qwen 3
     """
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
+# ========== JOB SUBMISSION ==========
+async def submit_job(update: Update, mode, domanda, status_text, escalated_from=None):
+    """Show the status message and queue the job for a worker"""
+    # Root span of the request; workers and delivery continue this trace
+    with span("telegram.request", mode=mode, chat_id=update.effective_chat.id,
+              escalated_from=escalated_from) as root:
+        with span("telegram.send", kind="status"):
+            msg = await update.effective_message.reply_text(status_text, parse_mode='Markdown')
+        
+        try:
+            with span("queue.enqueue"):
+                job_id = await asyncio.to_thread(
+                    JOB_QUEUE.enqueue, mode, domanda, update.effective_chat.id, msg.message_id,
+                    root.trace_id, root.span_id, escalated_from
+                )
+            root.set("job_id", job_id)
+            logger.info(f"Job {job_id} queued: {mode} for chat {update.effective_chat.id}")
+        except Exception as e:
+            logger.error(f"Enqueue error: {e}")
+            root.error(e)
+            await msg.delete()
+            await update.effective_message.reply_text(f"❌ Errore: {str(e)}")
+
 # ========== QUICK MODE ==========
 async def quick_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Quick mode - 1 model"""
@@ -176,31 +241,10 @@ async def quick_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    domanda = " ".join(context.args)
-    
-    msg = await update.message.reply_text(
-        "🟢 *Modalità QUICK*\n⏳ 1 modello al lavoro...\n\n_~10 secondi_",
-        parse_mode='Markdown'
+    await submit_job(
+        update, "quick", " ".join(context.args),
+        "🟢 *Modalità QUICK*\n⏳ 1 modello al lavoro...\n\n_~10 secondi_"
     )
-    
-    try:
-        risposta = query_groq(
-            "llama-3.3-70b-versatile",
-            "Sei un esperto generalista. Fornisci risposta completa e chiara.",
-            domanda
-        )
-        
-        await msg.delete()
-        
-        final_msg = f"🟢 *QUICK - Risposta:*\n\n{risposta}\n\n💰 1 modello"
-        
-        for part in split_message(final_msg):
-            await update.message.reply_text(part, parse_mode='Markdown')
-    
-    except Exception as e:
-        logger.error(f"Quick error: {e}")
-        await msg.delete()
-        await update.message.reply_text(f"❌ Errore: {str(e)}")
 
 # ========== STANDARD MODE ==========
 async def standard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -212,48 +256,10 @@ async def standard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    domanda = " ".join(context.args)
-    
-    msg = await update.message.reply_text(
-        "🟡 *Modalità STANDARD*\n⏳ 3 agenti stanno analizzando...\n\n_~30 secondi_",
-        parse_mode='Markdown'
+    await submit_job(
+        update, "standard", " ".join(context.args),
+        "🟡 *Modalità STANDARD*\n⏳ 3 agenti stanno analizzando...\n\n_~30 secondi_"
     )
-    
-    try:
-        agents = [
-            ("llama-3.1-8b-instant", "Analista Tecnico", "Analisi dettagliata"),
-            ("openai/gpt-oss-20b", "Esperto Pratico", "Esempi concreti e soluzioni pratiche"),
-            ("qwen/qwen3-32b", "Pensatore Critico", "Analisi critica e prospettive alternative")
-        ]
-        
-        responses = []
-        for model, role, goal in agents:
-            r = query_groq(model, f"Sei un {role}. {goal}.", domanda)
-            responses.append((role, r))
-        
-        # Synthesis
-        synthesis_prompt = "Sintetizza queste 3 analisi:\n\n"
-        for role, resp in responses:
-            synthesis_prompt += f"{role}: {resp}\n\n"
-        
-        finale = query_groq(
-            "llama-3.3-70b-versatile",
-            "Sintetizza le analisi in una risposta coerente e completa.",
-            synthesis_prompt
-        )
-        
-        await msg.delete()
-        
-        final_msg = f"🟡 *STANDARD - Risposta Sintetizzata:*\n\n{finale}\n\n"
-        final_msg += "📊 *Dettagli:* 3 modelli consultati"
-        
-        for part in split_message(final_msg):
-            await update.message.reply_text(part, parse_mode='Markdown')
-    
-    except Exception as e:
-        logger.error(f"Standard error: {e}")
-        await msg.delete()
-        await update.message.reply_text(f"❌ Errore: {str(e)}")
 
 # ========== DEEP MODE ==========
 async def deep_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -265,59 +271,10 @@ async def deep_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    domanda = " ".join(context.args)
-    
-    msg = await update.message.reply_text(
-        "🟠 *Modalità DEEP*\n⏳ 5 agenti esperti stanno analizzando...\n\n_~60 secondi - Attendi_",
-        parse_mode='Markdown'
+    await submit_job(
+        update, "deep", " ".join(context.args),
+        "🟠 *Modalità DEEP*\n⏳ 5 agenti esperti stanno analizzando...\n\n_~60 secondi - Attendi_"
     )
-    
-    try:
-        agents = [
-            ("llama-3.1-8b-instant", "Analista Veloce"),
-            ("llama-3.3-70b-versatile", "Stratega"),
-            ("openai/gpt-oss-20b", "Esperto Pratico"),
-            ("qwen/qwen3-32b", "Pensatore Alternativo"),
-            ("meta-llama/llama-4-scout-17b-16e-instruct", "Verificatore Moderno")
-        ]
-        
-        responses = []
-        for i, (model, role) in enumerate(agents, 1):
-            await msg.edit_text(
-                f"🟠 *Modalità DEEP*\n⏳ Agente {i}/5: {role}...",
-                parse_mode='Markdown'
-            )
-            r = query_groq(model, f"Sei un {role}.", domanda)
-            responses.append((role, r))
-        
-        await msg.edit_text(
-            "🟠 *Modalità DEEP*\n🎯 Sintetizzazione finale...",
-            parse_mode='Markdown'
-        )
-        
-        # Synthesis
-        synthesis_prompt = "Crea sintesi definitiva da queste 5 analisi:\n\n"
-        for role, resp in responses:
-            synthesis_prompt += f"{role}: {resp}\n\n"
-        
-        finale = query_groq(
-            "openai/gpt-oss-120b",
-            "Crea sintesi completa e bilanciata da tutte le prospettive.",
-            synthesis_prompt
-        )
-        
-        await msg.delete()
-        
-        final_msg = f"🟠 *DEEP - Risposta da 5 Prospettive:*\n\n{finale}\n\n"
-        final_msg += "📊 *5 modelli premium consultati*"
-        
-        for part in split_message(final_msg):
-            await update.message.reply_text(part, parse_mode='Markdown')
-    
-    except Exception as e:
-        logger.error(f"Deep error: {e}")
-        await msg.delete()
-        await update.message.reply_text(f"❌ Errore: {str(e)}")
 
 # ========== EXPERT MODE ==========
 async def expert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -329,60 +286,190 @@ async def expert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    domanda = " ".join(context.args)
+    await submit_job(
+        update, "expert", " ".join(context.args),
+        "🔴 *Modalità EXPERT*\n⏳ 6 modelli premium stanno analizzando...\n\n_~2 minuti - Massima qualità_"
+    )
+
+# ========== PANEL MODE ==========
+async def panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Panel mode - 12 perspectives with hierarchical synthesis"""
+    if not context.args:
+        await update.message.reply_text(
+            "🟣 *Modalità PANEL*\n\nUso: `/panel [domanda]`\nEsempio: `/panel Conviene aprire un ristorante?`",
+            parse_mode='Markdown'
+        )
+        return
     
-    msg = await update.message.reply_text(
-        "🔴 *Modalità EXPERT*\n⏳ 6 modelli premium stanno analizzando...\n\n_~2 minuti - Massima qualità_",
-        parse_mode='Markdown'
+    await submit_job(
+        update, "panel", " ".join(context.args),
+        f"🟣 *Modalità PANEL*\n⏳ {len(PANEL_AGENTS)} prospettive in parallelo...\n\n_~90 secondi_"
     )
+
+# ========== ESCALATION ==========
+def escalation_keyboard(job):
+    """Button that reruns a delivered answer one mode deeper, or None"""
+    next_mode = ESCALATION.get(job["mode"])
+    if next_mode is None:
+        return None
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(f"⬆️ Approfondisci con {next_mode.upper()}", callback_data=f"esc:{job['id']}")
+    ]])
+
+async def escalate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Escalate button: only the agents the deeper mode adds are run, then it re-synthesizes"""
+    query = update.callback_query
+    job = await asyncio.to_thread(JOB_QUEUE.get, int(query.data.split(":", 1)[1]))
+    if (job is None or job["chat_id"] != update.effective_chat.id or job["status"] != "done"
+            or job["mode"] not in ESCALATION):
+        await query.answer("Risposta non più disponibile")
+        return
     
+    await query.answer()
+    # One escalation per answer
     try:
-        agents = [
-            ("llama-3.1-8b-instant", "Analista Veloce"),
-            ("llama-3.3-70b-versatile", "Stratega Master"),
-            ("openai/gpt-oss-120b", "Pensatore Profondo"),
-            ("openai/gpt-oss-20b", "Esperto Pratico"),
-            ("qwen/qwen3-32b", "Critico Costruttivo"),
-            ("meta-llama/llama-guard-4-12b", "Verificatore Globale")
-        ]
-        
-        responses = []
-        for i, (model, role) in enumerate(agents, 1):
-            await msg.edit_text(
-                f"🔴 *Modalità EXPERT*\n⏳ Agente {i}/6: {role}...",
-                parse_mode='Markdown'
-            )
-            r = query_groq(model, f"Sei un {role}.", domanda)
-            responses.append((role, r))
-        
-        await msg.edit_text(
-            "🔴 *Modalità EXPERT*\n🎯 Super-sintesi master in corso...",
+        await query.edit_message_reply_markup(reply_markup=None)
+    except TelegramError:
+        pass
+    
+    next_mode = ESCALATION[job["mode"]]
+    await submit_job(
+        update, next_mode, job["question"],
+        f"⬆️ *Modalità {next_mode.upper()}*\n♻️ Riuso le risposte già calcolate, lavorano solo gli agenti mancanti...",
+        escalated_from=job["id"]
+    )
+
+# ========== HISTORY ==========
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Search this chat's past answers"""
+    if not context.args:
+        await update.message.reply_text(
+            "📚 *Storico*\n\nUso: `/history [parole]`\nEsempio: `/history lavoro remoto`\n"
+            "Testo completo: `/history #42`",
             parse_mode='Markdown'
         )
+        return
+    
+    user = f"telegram:{update.effective_chat.id}"
+    query = " ".join(context.args)
+    
+    # Answers may contain anything, so history is sent as plain text
+    if re.fullmatch(r"#\d+", query):
+        entry = await asyncio.to_thread(HISTORY.get, int(query[1:]), user)
+        if entry is None:
+            await update.message.reply_text(f"❌ Risposta {query} non trovata")
+            return
+        date = datetime.fromtimestamp(entry["created_at"]).strftime("%d/%m/%Y %H:%M")
+        text = f"📚 {query} · {entry['mode'].upper()} · {date}\n❓ {entry['question']}\n\n{entry['answer']}"
+        for part in split_message(text):
+            await update.message.reply_text(part)
+        return
+    
+    with span("history.search", chat_id=update.effective_chat.id) as s:
+        results = await asyncio.to_thread(HISTORY.search, query, user, 5)
+        s.set("results", len(results))
+    
+    if not results:
+        await update.message.reply_text(f"📭 Nessuna risposta trovata per: {query}")
+        return
+    
+    text = f"📚 Risultati per: {query}\n\n"
+    for r in results:
+        date = datetime.fromtimestamp(r["created_at"]).strftime("%d/%m/%Y %H:%M")
+        text += f"#{r['id']} · {r['mode'].upper()} · {date}\n❓ {r['question']}\n{r['snippet']}\n\n"
+    text += "Testo completo: /history #numero"
+    
+    for part in split_message(text):
+        await update.message.reply_text(part)
+
+# ========== RESULT DELIVERY ==========
+async def send_waiting(bot, chat_id, text, **kwargs):
+    """bot.send_message, waiting out Telegram flood control (RetryAfter) up to MAX_FLOOD_WAITS times"""
+    for _ in range(MAX_FLOOD_WAITS):
+        try:
+            return await bot.send_message(chat_id, text, **kwargs)
+        except RetryAfter as e:
+            logger.warning(f"Flood control on chat {chat_id}, waiting {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+    return await bot.send_message(chat_id, text, **kwargs)
+
+async def send_parts(bot, chat_id, text, reply_markup=None, first=1, on_sent=None):
+    """Send a long message, falling back to plain text if Markdown is rejected.
+    reply_markup goes on the last part. Parts before first were already sent;
+    on_sent(i) is awaited after part i goes out"""
+    parts = split_message(text)
+    for i, part in enumerate(parts, 1):
+        if i < first:
+            continue
+        markup = reply_markup if i == len(parts) else None
+        with span("telegram.send", kind="answer", part=i, parts=len(parts), chars=len(part)) as s:
+            try:
+                await send_waiting(bot, chat_id, part, parse_mode='Markdown', reply_markup=markup)
+            except BadRequest:
+                s.event("markdown_rejected")
+                await send_waiting(bot, chat_id, part, reply_markup=markup)
+        if on_sent is not None:
+            await on_sent(i)
+
+async def deliver_job(bot, job):
+    """Route a finished job back to its chat"""
+    with span("telegram.deliver", trace_id=job["trace_id"], parent_id=job["parent_span_id"],
+              job_id=job["id"], status=job["status"]):
+        if job["status_message_id"] and not job["parts_delivered"]:
+            try:
+                await bot.delete_message(job["chat_id"], job["status_message_id"])
+            except TelegramError:
+                pass
         
-        # Master synthesis
-        synthesis_prompt = "Crea sintesi definitiva master da queste 6 analisi esperte:\n\n"
-        for role, resp in responses:
-            synthesis_prompt += f"{role}: {resp}\n\n"
-        
-        finale = query_groq(
-            "openai/gpt-oss-120b",
-            "Crea sintesi definitiva master integrando tutte le prospettive.",
-            synthesis_prompt
-        )
-        
-        await msg.delete()
-        
-        final_msg = f"🔴 *EXPERT - Risposta Master da 6 AI:*\n\n{finale}\n\n"
-        final_msg += "📊 *6 modelli top-tier consultati*"
-        
-        for part in split_message(final_msg):
-            await update.message.reply_text(part, parse_mode='Markdown')
+        if job["status"] == "done":
+            async def sent(part):
+                await asyncio.to_thread(JOB_QUEUE.mark_part_delivered, job["id"], part)
+
+            # A retried delivery resumes after the parts the user already has
+            await send_parts(bot, job["chat_id"], job["result"]["text"], escalation_keyboard(job),
+                             first=job["parts_delivered"] + 1, on_sent=sent)
+        else:
+            await bot.send_message(job["chat_id"], f"❌ Errore: {job['error']}")
     
-    except Exception as e:
-        logger.error(f"Expert error: {e}")
-        await msg.delete()
-        await update.message.reply_text(f"❌ Errore: {str(e)}")
+    # Whole request, from the user's message to the last part sent
+    record_span(
+        "request.e2e", job["created_at"], time.time(), job["trace_id"], job["parent_span_id"],
+        job_id=job["id"], mode=job["mode"]
+    )
+
+async def deliver_results(bot):
+    """Forward worker progress and results to Telegram, forever"""
+    while True:
+        try:
+            for job in await asyncio.to_thread(JOB_QUEUE.progress_updates):
+                with span("telegram.edit", trace_id=job["trace_id"], parent_id=job["parent_span_id"], job_id=job["id"]):
+                    try:
+                        await bot.edit_message_text(
+                            job["progress"], job["chat_id"], job["status_message_id"], parse_mode='Markdown'
+                        )
+                    except TelegramError:
+                        pass
+                await asyncio.to_thread(JOB_QUEUE.mark_progress_delivered, job["id"], job["progress"])
+            
+            for job in await asyncio.to_thread(JOB_QUEUE.finished):
+                try:
+                    await deliver_job(bot, job)
+                    await asyncio.to_thread(JOB_QUEUE.mark_delivered, job["id"])
+                except Exception as e:
+                    logger.error(f"Delivery error for job {job['id']}: {e}")
+                    await asyncio.to_thread(JOB_QUEUE.delivery_failed, job["id"])
+        except Exception as e:
+            logger.error(f"Delivery loop error: {e}")
+        
+        await asyncio.sleep(DELIVERY_INTERVAL_SECONDS)
+
+async def post_init(app: Application):
+    """Start the delivery loop once the bot is up"""
+    # initialize() already called getMe, so the Telegram connection is warm
+    STARTUP.finish("telegram_connect")
+    # Report event loop lag and catch whatever blocks the handlers
+    LOOP_MONITOR.start()
+    app.create_task(deliver_results(app.bot))
 
 # ========== DEFAULT MESSAGE HANDLER ==========
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -400,14 +487,24 @@ def main():
     global application
     
     logger.info("Starting Multi-AI Bot with Flask health check...")
+    warn_ephemeral_storage()
+    
+    # Open the Groq connection while the rest boots
+    GROQ_POOL.prewarm()
     
     # Start Flask in background thread
     flask_thread = threading.Thread(target=run_flask, daemon=True)
     flask_thread.start()
     logger.info(f"Flask server started on port {PORT}")
     
+    # Pipeline workers (jobs left over from a previous run are picked up too)
+    if EMBEDDED_WORKERS:
+        start_workers(JOB_QUEUE, EMBEDDED_WORKERS, workers_stop, history=HISTORY)
+        logger.info(f"{EMBEDDED_WORKERS} embedded workers started")
+    STARTUP.mark("workers")
+    
     # Start Telegram bot
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -416,6 +513,9 @@ def main():
     application.add_handler(CommandHandler("standard", standard_command))
     application.add_handler(CommandHandler("deep", deep_command))
     application.add_handler(CommandHandler("expert", expert_command))
+    application.add_handler(CommandHandler("panel", panel_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CallbackQueryHandler(escalate_callback, pattern=r"^esc:\d+$"))
     
     # Default message handler (uses STANDARD)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -423,8 +523,10 @@ def main():
     # Error handler
     application.add_error_handler(error_handler)
     
+    STARTUP.mark("telegram_setup")
+    
     # Run polling
-    logger.info("Bot started - All 4 modes active!")
+    logger.info("Bot started - All 5 modes active!")
     application.run_polling(
         allowed_updates=Update.ALL_TYPES,
         drop_pending_updates=True
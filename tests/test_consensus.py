@@ -0,0 +1,73 @@
+import os
+
+os.environ.setdefault("TRACE_FILE", "")
+
+import consensus  # noqa: E402
+
+AGREE = [
+    "La capitale della Francia è Parigi. È anche la città più popolosa del paese, con circa 2,1 milioni di abitanti.",
+    "Parigi è la capitale della Francia, nonché la sua città più grande con circa 2,1 milioni di abitanti nel comune.",
+    "La capitale francese è Parigi, città più popolosa della Francia (circa 2,1 milioni di abitanti).",
+]
+
+BITCOIN = (
+    "Investire in Bitcoin è consigliabile per chi ha un orizzonte lungo. "
+    "Il rischio è adeguato al rendimento atteso. "
+    "La volatilità è gestibile con piccoli importi periodici."
+)
+BITCOIN_DENIED = (
+    "Investire in Bitcoin non è consigliabile per chi ha un orizzonte lungo. "
+    "Il rischio non è adeguato al rendimento atteso. "
+    "La volatilità non è gestibile con piccoli importi periodici."
+)
+
+
+def test_agreeing_answers_skip_synthesis():
+    answer, score = consensus.find_consensus("test", AGREE, threshold=0.6)
+    assert answer in AGREE
+    assert score >= 0.6
+
+
+def test_negated_answer_is_not_consensus():
+    score, _ = consensus.agreement([BITCOIN, BITCOIN, BITCOIN_DENIED])
+    assert score < 0.5
+    answer, _ = consensus.find_consensus("test", [BITCOIN, BITCOIN_DENIED], threshold=0.6)
+    assert answer is None
+
+
+def test_negations_in_one_sentence_do_not_cancel_out():
+    score, _ = consensus.agreement([
+        "Investire in Bitcoin è consigliabile, la volatilità è gestibile.",
+        "Investire in Bitcoin non è consigliabile, la volatilità non è gestibile.",
+    ])
+    assert score < 0.5
+
+
+def test_single_negated_statement_is_a_contradiction():
+    a = consensus.Profile("Il vaccino è sicuro per i bambini.")
+    b = consensus.Profile("Il vaccino non è sicuro per i bambini.")
+    assert consensus.contradicts(a, b)
+    assert not consensus.contradicts(a, consensus.Profile("Il vaccino è sicuro per i bambini piccoli."))
+
+
+def test_different_figures_lower_agreement():
+    score, _ = consensus.agreement([
+        "L'uomo è arrivato sulla Luna nel 1969 con la missione Apollo 11.",
+        "L'uomo è arrivato sulla Luna nel 1968 con la missione Apollo 8.",
+    ])
+    assert score < 0.6
+
+
+def test_different_names_are_not_consensus():
+    rust = "Ti consiglio di imparare Rust, perché è veloce, sicuro e molto richiesto dalle aziende."
+    go = "Ti consiglio di imparare Go, perché è veloce, sicuro e molto richiesto dalle aziende."
+    answer, score = consensus.find_consensus("test", [rust, rust, go], threshold=0.6)
+    assert answer is None
+    assert score < 0.6
+
+
+def test_failed_answers_are_ignored():
+    answer, score = consensus.find_consensus("test", [AGREE[0], "Errore API: timeout"], threshold=0.0)
+    assert answer is None
+    # Not checked: no score, so the run is not counted as a miss
+    assert score is None
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+os.environ.setdefault("TRACE_FILE", "")
+
+import pytest  # noqa: E402
+import requests  # noqa: E402
+from groq_pool import GroqKeyPool  # noqa: E402
+
+
+class FakeGroq:
+    """Answers by (key, model) from a dict of behaviours: 'ok', 'slow', or a status code"""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.calls = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                key = self.headers["Authorization"][len("Bearer "):]
+                fake.calls.append((key, body["model"]))
+                action = fake.behaviour.get((key, body["model"]), "ok")
+                if action == "slow":
+                    time.sleep(0.5)
+                if isinstance(action, int):
+                    self.send_response(action)
+                    self.send_header("retry-after", "30")
+                    self.end_headers()
+                    return
+                payload = json.dumps({"choices": [{"message": {"content": key}}], "usage": {"total_tokens": 1}}).encode()
+                self.send_response(200)
+                self.send_header("x-ratelimit-limit-requests", "100")
+                self.send_header("x-ratelimit-remaining-requests", "90" if key == "key-a-000000" else "50")
+                self.send_header("x-ratelimit-reset-requests", "60s")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def close(self):
+        self.server.shutdown()
+
+
+def chat(pool, model, timeout=5):
+    return pool.chat({"model": model, "messages": []}, timeout=timeout)["choices"][0]["message"]["content"]
+
+
+def test_rate_limit_benches_the_key_for_that_model_only():
+    fake = FakeGroq({("key-a-000000", "big"): 429})
+    pool = GroqKeyPool(["key-a-000000", "key-b-000000"], url=fake.url, max_wait=0)
+    try:
+        # "big" on A is rate limited: the call moves to B, and A is benched for "big" only
+        assert chat(pool, "big") == "key-b-000000"
+        assert chat(pool, "big") == "key-b-000000"
+        a = pool.keys[0]
+        assert not a.available("big", time.monotonic())
+        assert a.available("small", time.monotonic())
+        # B's "big" headers do not leak into B's "small" window
+        assert pool.keys[1].quota("small").remaining_requests is None
+        assert pool.keys[1].quota("big").remaining_requests == 50
+    finally:
+        fake.close()
+
+
+def test_auth_error_fails_over_to_another_key():
+    fake = FakeGroq({("key-a-000000", "m"): 401})
+    pool = GroqKeyPool(["key-a-000000", "key-b-000000"], url=fake.url, max_wait=0)
+    try:
+        assert chat(pool, "m") == "key-b-000000"
+        assert pool.keys[0].disabled
+    finally:
+        fake.close()
+
+
+def test_timeouts_are_retried_once_not_per_key():
+    fake = FakeGroq({(k, "m"): "slow" for k in ("key-a-000000", "key-b-000000", "key-c-000000")})
+    pool = GroqKeyPool(["key-a-000000", "key-b-000000", "key-c-000000"], url=fake.url, max_wait=0)
+    try:
+        with pytest.raises(requests.Timeout):
+            chat(pool, "m", timeout=0.1)
+        assert len(fake.calls) == 2
+    finally:
+        fake.close()
+
+
+def test_server_errors_are_retried_once():
+    fake = FakeGroq({(k, "m"): 503 for k in ("key-a-000000", "key-b-000000", "key-c-000000")})
+    pool = GroqKeyPool(["key-a-000000", "key-b-000000", "key-c-000000"], url=fake.url, max_wait=0)
+    try:
+        with pytest.raises(requests.HTTPError):
+            chat(pool, "m")
+        assert len(fake.calls) == 2
+    finally:
+        fake.close()
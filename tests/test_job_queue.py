@@ -0,0 +1,92 @@
+import os
+import threading
+
+os.environ.setdefault("TRACE_FILE", "")
+
+import job_queue  # noqa: E402
+
+
+def make_queue(tmp_path):
+    return job_queue.SQLiteJobQueue(str(tmp_path / "jobs.db"))
+
+
+def make_stale(queue, job_id):
+    queue._execute("UPDATE jobs SET heartbeat_at = 0 WHERE id = ?", (job_id,))
+
+
+def test_claim_takes_the_oldest_queued_job(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.enqueue("quick", "a", 1)
+    queue.enqueue("quick", "b", 1)
+    job = queue.claim("w1")
+    assert job["id"] == first
+    assert job["status"] == "running"
+    assert job["worker"] == "w1"
+    assert job["attempts"] == 1
+
+
+def test_concurrent_claims_never_share_a_job(tmp_path):
+    queue = make_queue(tmp_path)
+    ids = {queue.enqueue("quick", str(i), 1) for i in range(50)}
+    claimed = []
+    lock = threading.Lock()
+
+    def work(name):
+        # Each thread gets its own connection, like separate worker processes
+        while True:
+            job = queue.claim(name)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == sorted(ids)
+    assert queue.claim("late") is None
+
+
+def test_requeue_stale_retries_until_max_attempts(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("quick", "q", 1)
+    for attempt in range(1, job_queue.MAX_ATTEMPTS):
+        assert queue.claim("w")["attempts"] == attempt
+        make_stale(queue, job_id)
+        assert queue.requeue_stale() == 1
+        assert queue.get(job_id)["status"] == "queued"
+
+    queue.claim("w")
+    make_stale(queue, job_id)
+    assert queue.requeue_stale() == 0
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "Worker perso troppe volte"
+    assert [j["id"] for j in queue.finished()] == [job_id]
+
+
+def test_requeue_stale_leaves_live_jobs_alone(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("quick", "q", 1)
+    queue.claim("w")
+    assert queue.requeue_stale() == 0
+    assert queue.get(job_id)["status"] == "running"
+
+
+def test_delivery_is_abandoned_after_max_delivery_attempts(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("quick", "q", 1)
+    queue.claim("w")
+    queue.complete(job_id, {"text": "ok"})
+    for _ in range(job_queue.MAX_DELIVERY_ATTEMPTS - 1):
+        queue.delivery_failed(job_id)
+        assert queue.get(job_id)["delivered_at"] is None
+        assert [j["id"] for j in queue.finished()] == [job_id]
+
+    queue.delivery_failed(job_id)
+    job = queue.get(job_id)
+    assert job["delivery_attempts"] == job_queue.MAX_DELIVERY_ATTEMPTS
+    assert job["delivered_at"] is not None
+    assert queue.finished() == []
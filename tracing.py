@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger(__name__)
+
+# ========== CONFIGURATION ==========
+# Spans go here as OTLP/JSON lines (readable by the OpenTelemetry
+# Collector's otlpjsonfile receiver). Off by default: the file is never
+# rotated, so point it at a collector-tailed path when you turn it on.
+TRACE_FILE = os.getenv('TRACE_FILE', "")
+SERVICE_NAME = os.getenv('SERVICE_NAME', "multi-ai-system")
+EXPORT_BATCH = 64
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'
+
+# (trace_id, span_id) of the span running in this context
+_current = contextvars.ContextVar("current_span", default=None)
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def _new_span_id():
+    return secrets.token_hex(8)
+
+
+def current_trace_id():
+    current = _current.get()
+    return current[0] if current else None
+
+
+def current_span_id():
+    current = _current.get()
+    return current[1] if current else None
+
+
+def bind(fn):
+    """Carry the current trace context into a worker thread.
+
+    Each call runs in a fresh copy of the context captured here, so the
+    wrapper is safe to use with ThreadPoolExecutor.map.
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+
+# ========== EXPORT ==========
+def _attr_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class SpanExporter:
+    """Writes finished spans to TRACE_FILE from a background thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        if not self.path:
+            return
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self.thread.start()
+        self.queue.put(span)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < EXPORT_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                batch = [s for s in batch if s is not None]
+                self._write(batch)
+                return
+            self._write(batch)
+
+    def _write(self, spans):
+        if not spans:
+            return
+        line = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                    {"key": "process.pid", "value": {"intValue": str(os.getpid())}}
+                ]},
+                "scopeSpans": [{"scope": {"name": "multi-ai"}, "spans": spans}]
+            }]
+        }
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Span export failed: {e}")
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
+
+EXPORTER = SpanExporter(TRACE_FILE)
+atexit.register(EXPORTER.close)
+
+
+# ========== SPANS ==========
+class Span:
+    """An in-progress span; set() adds attributes, event() adds timestamped events"""
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.events = []
+        self.start_ns = time.time_ns()
+        self.status = (STATUS_OK, "")
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def event(self, name, **attributes):
+        self.events.append({
+            "name": name,
+            "timeUnixNano": str(time.time_ns()),
+            "attributes": [{"key": k, "value": _attr_value(v)} for k, v in attributes.items()]
+        })
+
+    def error(self, message):
+        self.status = (STATUS_ERROR, str(message))
+
+    def to_otlp(self, end_ns):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [{"key": k, "value": _attr_value(v)} for k, v in self.attributes.items() if v is not None],
+            "events": self.events,
+            "status": {"code": self.status[0], "message": self.status[1]}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+@contextmanager
+def span(name, trace_id=None, parent_id=None, **attributes):
+    """Time a block as a span.
+
+    Nested spans pick up the enclosing one as parent. Pass trace_id and
+    parent_id to continue a trace started elsewhere (e.g. across the job
+    queue); with neither and no enclosing span a new trace starts.
+    """
+    current = _current.get()
+    if trace_id is None:
+        trace_id, parent_id = current if current else (new_trace_id(), None)
+
+    s = Span(name, trace_id, parent_id, attributes)
+    token = _current.set((s.trace_id, s.span_id))
+    try:
+        yield s
+    except BaseException as e:
+        s.error(e)
+        raise
+    finally:
+        _current.reset(token)
+        EXPORTER.export(s.to_otlp(time.time_ns()))
+
+
+def record_span(name, start, end, trace_id, parent_id=None, **attributes):
+    """Export a span measured after the fact (start/end are epoch seconds)"""
+    if not trace_id:
+        return
+    s = Span(name, trace_id, parent_id, attributes)
+    s.start_ns = int(start * 1e9)
+    EXPORTER.export(s.to_otlp(int(end * 1e9)))
+
+
+# ========== LOGGING ==========
+class TraceIdFilter(logging.Filter):
+    """Stamp each record with the trace id of the context that logged it"""
+
+    def filter(self, record):
+        record.trace_id = current_trace_id() or "-"
+        return True
+
+
+_listener = None
+
+
+def setup_logging(level=logging.INFO, fmt=LOG_FORMAT):
+    """Log through a QueueHandler so callers never block on I/O.
+
+    The trace id is captured in the calling thread; a QueueListener thread
+    does the formatting and writing.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(fmt))
+
+    log_queue = queue.SimpleQueue()
+    handler = QueueHandler(log_queue)
+    handler.addFilter(TraceIdFilter())
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,148 @@
+import os
+import time
+import socket
+import signal
+import logging
+import argparse
+import threading
+from job_queue import open_queue, LEASE_SECONDS
+from pipelines import PIPELINES, GROQ_POOL
+from tracing import span, record_span, setup_logging
+from history import AnswerHistory
+from escalation import build_reuse
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = 1.0
+HEARTBEAT_SECONDS = max(LEASE_SECONDS // 4, 1)
+
+
+def _heartbeat(queue, job_id, done):
+    """Keep the job lease alive while the pipeline runs"""
+    while not done.wait(HEARTBEAT_SECONDS):
+        queue.heartbeat(job_id)
+
+
+def save_history(history, job, result):
+    """Append the answer to the searchable history; never fails the job"""
+    try:
+        history.add(
+            user=f"telegram:{job['chat_id']}",
+            source="telegram",
+            mode=job["mode"],
+            question=job["question"],
+            answer=result["answer"],
+            agents=result["agents"],
+            duration=time.time() - job["created_at"]
+        )
+    except Exception as e:
+        logger.error(f"History error for job {job['id']}: {e}")
+
+
+def reusable_agents(queue, job):
+    """Agent answers of the jobs this one escalates from, newest first"""
+    agents = []
+    seen = set()
+    parent_id = job.get("escalated_from")
+    while parent_id is not None and parent_id not in seen:
+        seen.add(parent_id)
+        parent = queue.get(parent_id)
+        if parent is None:
+            break
+        if parent["status"] == "done":
+            agents.extend(parent["result"]["agents"])
+        parent_id = parent.get("escalated_from")
+    return agents
+
+
+def run_job(queue, job, history=None):
+    """Run one claimed job and store its outcome"""
+    pipeline = PIPELINES.get(job["mode"])
+    if pipeline is None:
+        queue.fail(job["id"], f"Modalità sconosciuta: {job['mode']}")
+        return
+
+    # Time spent waiting in the queue, then the pipeline itself, both in the request's trace
+    record_span(
+        "queue.wait", job["created_at"], job["claimed_at"], job["trace_id"], job["parent_span_id"],
+        job_id=job["id"], attempt=job["attempts"]
+    )
+
+    done = threading.Event()
+    threading.Thread(target=_heartbeat, args=(queue, job["id"], done), daemon=True).start()
+    with span(f"pipeline.{job['mode']}", trace_id=job["trace_id"], parent_id=job["parent_span_id"],
+              job_id=job["id"], worker=job["worker"]) as s:
+        try:
+            reuse = build_reuse(reusable_agents(queue, job))
+            s.set("reused_answers", sum(len(answers) for answers in reuse.values()))
+            result = pipeline(job["question"], lambda text: queue.set_progress(job["id"], text), reuse=reuse)
+            queue.complete(job["id"], result)
+            if history is not None:
+                save_history(history, job, result)
+            logger.info(f"Job {job['id']} ({job['mode']}) done")
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['mode']}) error: {e}")
+            s.error(e)
+            queue.fail(job["id"], e)
+        finally:
+            done.set()
+
+
+def run_worker(queue, worker_id, stop_event, history=None):
+    """Pull and run jobs until stop_event is set"""
+    logger.info(f"Worker {worker_id} started")
+    while not stop_event.is_set():
+        try:
+            queue.requeue_stale()
+            job = queue.claim(worker_id)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} queue error: {e}")
+            job = None
+
+        if job is None:
+            stop_event.wait(POLL_INTERVAL_SECONDS)
+            continue
+
+        run_job(queue, job, history)
+    logger.info(f"Worker {worker_id} stopped")
+
+
+def start_workers(queue, count, stop_event, prefix=None, history=None):
+    """Start count worker threads, return them"""
+    prefix = prefix or f"{socket.gethostname()}-{os.getpid()}"
+    threads = []
+    for i in range(count):
+        t = threading.Thread(
+            target=run_worker,
+            args=(queue, f"{prefix}-{i}", stop_event, history),
+            name=f"worker-{i}",
+            daemon=True
+        )
+        t.start()
+        threads.append(t)
+    return threads
+
+
+def main():
+    """Standalone worker process: python worker.py --threads 4"""
+    parser = argparse.ArgumentParser(description="Multi-AI pipeline worker")
+    parser.add_argument("--threads", type=int, default=int(os.getenv('WORKER_THREADS', 2)))
+    args = parser.parse_args()
+
+    if not GROQ_POOL:
+        raise ValueError("GROQ_API_KEY / GROQ_API_KEYS not set")
+
+    setup_logging()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    threads = start_workers(open_queue(), args.threads, stop_event, history=AnswerHistory())
+    for t in threads:
+        while t.is_alive():
+            t.join(timeout=1)
+
+
+if __name__ == "__main__":
+    main()